@@ -0,0 +1,90 @@
+"""
+Measures the memory used by asset records and the build state keyed by them.
+
+Usage: python -m benchmarks.asset_memory [asset count]
+
+Paths for the given number of assets (100000 by default) are generated without
+touching the disk. Records as they used to be created, with a random UUID and a
+config dict, are compared with the slotted records identified by their relative path.
+Both are measured on their own, and together with the output path a driver sets
+and the per-asset input and output dictionaries a build keeps.
+"""
+
+from cas.common.assets.models import Asset
+
+import gc
+import sys
+import time
+import uuid
+import tracemalloc
+from pathlib import Path
+
+
+class _LegacyAsset:
+    def __init__(self, path: Path, config: dict):
+        self.id = uuid.uuid4()
+        self.path = path
+        self.config = config
+
+    def get_id(self):
+        return self.id
+
+
+def _build(paths, create, state: bool):
+    records = []
+    hash_inputs = {}
+    hash_outputs = {}
+    for index, path in enumerate(paths):
+        asset = create(path)
+        records.append(asset)
+        if state:
+            asset.outpath = path.with_suffix(".dat")
+            hash_inputs[index % 3, asset.get_id()] = [path]
+            hash_outputs[index % 3, asset.get_id()] = [asset.outpath]
+    return records, hash_inputs, hash_outputs
+
+
+def _measure(paths, create, state: bool) -> int:
+    gc.collect()
+    tracemalloc.start()
+    result = _build(paths, create, state)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def _time(paths, create) -> float:
+    gc.collect()
+    start = time.perf_counter()
+    _build(paths, create, False)
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    root = Path("/project") if sys.platform != "win32" else Path("C:/project")
+    paths = [
+        root.joinpath("game", "mod", "resource", f"{i // 1000}", f"asset_{i}.txt")
+        for i in range(count)
+    ]
+
+    print(f"{count} assets")
+    for name, create in [
+        ("uuid + config dict", lambda p: _LegacyAsset(p, {})),
+        ("slotted, relpath id", lambda p: Asset(p, root)),
+    ]:
+        records = _measure(paths, create, False)
+        state = _measure(paths, create, True)
+        elapsed = _time(paths, create)
+        print(
+            f"{name:20} records {records / 1024 / 1024:6.1f} MiB"
+            f" ({records / count:4.0f} bytes/asset),"
+            f" with build state {state / 1024 / 1024:6.1f} MiB,"
+            f" created in {elapsed * 1000:5.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Measures how much data the asset subsystem sends to its worker pool.
+
+Usage: python -m benchmarks.dispatch_overhead [asset count] [threads]
+
+A throwaway project with the given number of caption assets is generated, and the
+pickled size and pickling time of the per-job arguments are compared between
+sending (context, driver, asset) with every job and sending the contexts once per
+worker followed by compact job descriptors.
+"""
+
+import cas.common.utilities as utilities
+from cas.common.models import BuildEnvironment
+from cas.common.assets.models import Asset
+from cas.subsystems.assets import AssetSubsystem
+
+import sys
+import time
+import pickle
+import tempfile
+from pathlib import Path
+from dotmap import DotMap
+
+
+def _make_project(root: Path, count: int) -> DotMap:
+    bindir = root.joinpath("game", "bin", utilities.resolve_platform_name())
+    bindir.mkdir(parents=True)
+    bindir.joinpath("captioncompiler").touch()
+
+    resource = root.joinpath("game", "mod", "resource")
+    resource.mkdir(parents=True)
+    for i in range(count):
+        resource.joinpath(f"closecaption_{i}.txt").write_text("caption")
+
+    root.joinpath("content").mkdir()
+    root.joinpath("src").mkdir()
+    assets = {
+        "assets": [
+            {
+                "type": "caption",
+                "src": "$(path.game)",
+                "files": "mod/resource/closecaption_*.txt",
+            }
+        ]
+    }
+    return DotMap(
+        {
+            "options": {
+                "project": "mod",
+                "bin_path": str(root.joinpath("game", "bin")),
+            },
+            "subsystems": {
+                "assets": {
+                    "module": "cas.subsystems.assets",
+                    "categories": ["assets"],
+                    "options": assets,
+                }
+            },
+            "args": {
+                "paranoid": False,
+                "build_type": "trunk",
+                "build_categories": None,
+                "verbose": False,
+                "dry_run": True,
+                "threads": 1,
+            },
+        }
+    )
+
+
+def _measure(payloads) -> (int, float):
+    start = time.perf_counter()
+    size = sum(len(pickle.dumps(p)) for p in payloads)
+    return size, time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        env = BuildEnvironment(root, _make_project(root, count))
+        subsystem = AssetSubsystem(env, env.config.subsystems.assets.options)
+
+        contexts = [subsystem._load_asset_context(c) for c in subsystem.config.assets]
+        for context in contexts:
+            context.driver = subsystem._get_asset_driver(context.config.type)
+            context.assets = [
+                Asset(path, env.root) for path in subsystem._discover_assets(context)
+            ]
+
+        legacy = [
+            (context, context.driver, asset)
+            for context in contexts
+            for asset in context.assets
+        ]
+        jobs = [
+            subsystem._make_job(
+                index, context, [asset], {asset.get_id(): (None, 0.0)}
+            ).descriptor()
+            for index, context in enumerate(contexts)
+            for asset in context.assets
+        ]
+        worker_contexts = subsystem._worker_contexts(contexts)
+
+        legacy_size, legacy_time = _measure(legacy)
+        init_size, init_time = _measure([worker_contexts] * threads)
+        job_size, job_time = _measure(jobs)
+
+        print(f"{len(jobs)} jobs, {threads} workers")
+        print(
+            f"per-job context/driver/asset: {legacy_size / 1024 / 1024:8.1f} MiB {legacy_time * 1000:8.0f} ms"
+        )
+        print(
+            f"per-worker init + descriptors: {(init_size + job_size) / 1024 / 1024:8.1f} MiB"
+            f" {(init_time + job_time) * 1000:8.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Compares the throughput of the hash algorithms CAS can use for change detection.
+
+Usage: python -m benchmarks.hash_throughput [files...]
+
+If no files are given, a set of random binary files roughly the size of
+typical compiled models and textures is generated in a temporary directory.
+"""
+
+import cas.common.utilities as utilities
+
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+ALGORITHMS = ["sha256", "sha1", "sha512", "blake2b", "blake2s", "md5"]
+GENERATED_SIZES = [1, 16, 64, 256]  # MiB
+
+
+def _generate(root: Path):
+    files = []
+    for size in GENERATED_SIZES:
+        path = root.joinpath(f"asset_{size}mb.bin")
+        with open(path, "wb") as f:
+            for _ in range(size):
+                f.write(os.urandom(1024 * 1024))
+        files.append(path)
+    return files
+
+
+def _bench(files, algorithm: str, rounds: int = 3) -> float:
+    total = sum(os.path.getsize(f) for f in files)
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for f in files:
+            utilities.hash_file(f, [algorithm])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return total / best / (1024 * 1024)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [Path(f) for f in sys.argv[1:]] or _generate(Path(tmp))
+        total = sum(os.path.getsize(f) for f in files) / (1024 * 1024)
+        print(f"hashing {len(files)} file(s), {total:.0f} MiB total (best of 3)")
+
+        baseline = None
+        for algorithm in ALGORITHMS:
+            throughput = _bench(files, algorithm)
+            baseline = baseline or throughput
+            print(
+                f"{algorithm:>8}: {throughput:8.0f} MiB/s ({throughput / baseline:.2f}x sha256)"
+            )
+
+
+if __name__ == "__main__":
+    main()
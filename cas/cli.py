@@ -1,5 +1,6 @@
 import os
 import re
+import sys
 import json
 import argparse
 import logging
@@ -8,8 +9,7 @@ from pathlib import Path
 from dotmap import DotMap
 
 import cas.common.utilities as utilities
-from cas.common.sequencer import Sequencer
-
+import cas.common.daemon as daemon
 
 cjson_regex = re.compile(
     r"(\".*?\"|\'.*?\')|(/\*.*?\*/|//[^\r\n]*$)", re.MULTILINE | re.DOTALL
@@ -41,7 +41,7 @@ def _load_cjson(text: str) -> dict:
     return json.loads(result)
 
 
-def main():
+def _create_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Chaos Automation System CLI")
 
     parser.add_argument(
@@ -60,6 +60,27 @@ def main():
         default=multiprocessing.cpu_count(),
         help="Number of threads to use to build assets. Defaults to the number of CPUs on the system.",
     )
+    parser.add_argument(
+        "--paranoid",
+        action="store_true",
+        help="Verifies the contents of every cached file instead of trusting unchanged file sizes and timestamps.",
+    )
+    parser.add_argument(
+        "-e",
+        "--executor",
+        type=str.lower,
+        choices=["auto", "thread", "process"],
+        default="auto",
+        help=(
+            "How to run asset jobs in parallel. "
+            "auto uses threads for drivers that only run external tools and processes for the rest."
+        ),
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="Stops building assets as soon as one of them fails to compile.",
+    )
     parser.add_argument(
         "-c", "--clean", action="store_true", help="Cleans the build environment."
     )
@@ -83,6 +104,25 @@ def main():
         action="store_true",
         help="Write verbose output for debugging.",
     )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help="After building, keeps rebuilding the assets whose files change until interrupted.",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help=(
+            "Serves builds of the project from this process until interrupted. casbuild hands its builds "
+            "to a running daemon, which keeps the configuration, cache and drivers loaded between them."
+        ),
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Builds in this process even if a daemon is running for the project.",
+    )
     parser.add_argument(
         "-d",
         "--dry-run",
@@ -109,7 +149,40 @@ def main():
         type=str.lower,
         help="Comma-seperated list of subsystems to exclude from the build.",
     )
+    return parser
+
+
+def _load_config(root_path: Path, args: argparse.Namespace) -> DotMap:
+    config_file = root_path.joinpath("content", "cas.jsonc")
+    with config_file.open("r") as f:
+        config = DotMap(_load_cjson(f.read()))
+
+    # apply overrides
+    if not args.override:
+        args.override = []
+    for x in args.override:
+        assert x.count("=") <= 1, "invalid key-value operator"
+        if "=" in x:
+            spl = x.split("=", 1)
+            val = spl[1]
+
+            # if it starts with [ or {, parse as json
+            if val.startswith("[") or val.startswith("{"):
+                val = _load_cjson(val)
+            elif val.isdigit():
+                val = int(val)
+
+            utilities.set_dot_notation(config, spl[0], val)
+        else:
+            utilities.set_dot_notation(config, x, True)
+
+    config["args"] = {**config.get("args", {}), **vars(args)}
+    config["args"]["cli"] = True
+    return config
+
 
+def main():
+    parser = _create_parser()
     args = parser.parse_args()
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
@@ -138,31 +211,25 @@ def main():
         )
         exit(1)
 
-    with config_file.open("r") as f:
-        config = DotMap(_load_cjson(f.read()))
+    if args.daemon:
+        if not daemon.BuildDaemon(root_path, parser, _load_config).serve():
+            exit(1)
+        return
 
-    # apply overrides
-    if not args.override:
-        args.override = []
-    for x in args.override:
-        assert x.count("=") <= 1, "invalid key-value operator"
-        if "=" in x:
-            spl = x.split("=", 1)
-            val = spl[1]
+    # watch mode is long running already, so it gains nothing from the daemon
+    if not args.no_daemon and not args.watch:
+        code = daemon.forward(root_path, sys.argv[1:])
+        if code is not None:
+            exit(code)
 
-            # if it starts with [ or {, parse as json
-            if val.startswith("[") or val.startswith("{"):
-                val = _load_cjson(val)
-            elif val.isdigit():
-                val = int(val)
-
-            utilities.set_dot_notation(config, spl[0], val)
-        else:
-            utilities.set_dot_notation(config, x, True)
-
-    config["args"] = {**config.get("args", {}), **vars(args)}
-    config["args"]["cli"] = True
+    # imported here, so handing the build to a daemon doesn't pay for loading it
+    from cas.common.sequencer import Sequencer
 
+    config = _load_config(root_path, args)
     sequencer = Sequencer(root_path, config)
-    if not sequencer.run():
+    success = sequencer.run()
+    # a failed build is what watch mode is there to fix
+    if args.watch:
+        success = sequencer.watch()
+    if not success:
         exit(1)
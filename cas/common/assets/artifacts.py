@@ -0,0 +1,194 @@
+from cas.common.fingerprint import FingerprintService
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+
+class ArtifactCache:
+    """
+    Local content-addressed store of compiled asset outputs.
+    Entries are keyed by everything that determines a compile result, so outputs
+    can be restored instead of invoking the tool again.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        path: Path,
+        max_size: int,
+        fingerprints: FingerprintService,
+        algorithm: str,
+    ):
+        self._root = root
+        self._path = path
+        self._max_size = max_size
+        self._fingerprints = fingerprints
+        self._algorithm = algorithm
+        self._logger = logging.getLogger(__name__)
+
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        # lookups happen on several threads at once
+        self._lock = threading.Lock()
+
+        self._path.mkdir(parents=True, exist_ok=True)
+
+    def _entry_path(self, key: str) -> Path:
+        return self._path.joinpath(key[:2], key)
+
+    def _relpath(self, path: Path) -> str:
+        return os.path.relpath(path, self._root).replace("\\", "/")
+
+    def key(
+        self,
+        driver: str,
+        options: Any,
+        tool: Path,
+        inputs: Sequence[Path],
+        outputs: Sequence[Path],
+    ) -> Optional[str]:
+        """
+        Computes the key of an asset from its driver, driver options, tool binary,
+        input contents and output locations.
+        Returns None if the tool or an input can't be read.
+        """
+        try:
+            data = {
+                "driver": driver,
+                "options": options,
+                "tool": self._fingerprints.digest(tool, self._algorithm),
+                "inputs": sorted(
+                    [self._relpath(f), self._fingerprints.digest(f, self._algorithm)]
+                    for f in inputs
+                ),
+                "outputs": sorted(self._relpath(f) for f in outputs),
+            }
+        except OSError as e:
+            # the asset is compiled instead, which reports what is missing
+            self._logger.debug(f"unable to compute an artifact key: {e}")
+            return None
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def restore(self, key: Optional[str], outputs: Sequence[Path]) -> bool:
+        """
+        Copies the stored outputs for a key back into place.
+        Returns True on a cache hit, a key of None is always a miss.
+        """
+        if key is None:
+            self._count_miss()
+            return False
+
+        entry = self._entry_path(key)
+        manifest = entry.joinpath("manifest.json")
+        if not manifest.exists():
+            self._count_miss()
+            return False
+
+        try:
+            with open(manifest, "r") as f:
+                stored = json.load(f)["outputs"]
+            if sorted(stored) != sorted(self._relpath(f) for f in outputs):
+                self._count_miss()
+                return False
+
+            for i, rel in enumerate(stored):
+                dest = self._root.joinpath(rel)
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(entry.joinpath(str(i)), dest)
+
+            # the manifest's mtime tracks when the entry was last used
+            os.utime(manifest)
+        except OSError as e:
+            # another build may have evicted the entry while it was being restored,
+            # the asset is compiled instead and overwrites anything copied so far
+            self._logger.debug(f"unable to restore artifact {key}: {e}")
+            self._count_miss()
+            return False
+
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def _count_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def store(self, key: str, outputs: Sequence[Path]):
+        """
+        Copies the outputs of a successful compile into the store
+        """
+        entry = self._entry_path(key)
+        if entry.exists() or not all(f.exists() for f in outputs):
+            return
+
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(dir=entry.parent))
+        try:
+            stored = []
+            for i, f in enumerate(outputs):
+                shutil.copyfile(f, tmp.joinpath(str(i)))
+                stored.append(self._relpath(f))
+            with open(tmp.joinpath("manifest.json"), "w") as f:
+                json.dump({"outputs": stored}, f)
+            os.replace(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            # another build may have stored the same entry first
+            if not entry.exists():
+                raise
+            return
+        with self._lock:
+            self.stored += 1
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the store fits in its size limit
+        """
+        # restores don't grow the store, so there is nothing to do unless a build stored
+        if self.stored == 0:
+            return
+
+        entries = []
+        total = 0
+        for bucket in os.scandir(self._path):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                manifest = os.path.join(entry.path, "manifest.json")
+                if not os.path.exists(manifest):
+                    continue
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((os.stat(manifest).st_mtime, size, entry.path))
+                total += size
+
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self._max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            evicted += 1
+
+        if evicted > 0:
+            self._logger.debug(f"evicted {evicted} artifact(s)")
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.stored = 0
+
+    def log_stats(self, logger: logging.Logger):
+        lookups = self.hits + self.misses
+        rate = (self.hits / lookups * 100) if lookups else 0
+        logger.info(
+            f"artifact cache: {self.hits} hit(s), {self.misses} miss(es) ({rate:.0f}% hit rate), {self.stored} stored"
+        )
@@ -0,0 +1,213 @@
+import threading
+from pathlib import Path
+from typing import Any, Callable, Hashable, List, Mapping, Sequence, Set
+
+# the asset producing a file is not known yet, an asset of a context is still
+# being looked at, or an asset is still to be found up to date or submitted
+_PATH = "path"
+_CONTEXT = "context"
+_KEY = "key"
+# an asset was just held
+_HOLD = "hold"
+
+
+class HeldAsset:
+    """
+    An asset waiting for the assets producing the files it is compiled from
+    """
+
+    __slots__ = ("key", "paths", "after", "match", "producers", "unproduced", "_next")
+
+    def __init__(
+        self,
+        key: Hashable,
+        paths: Sequence[Path],
+        after: Sequence[int],
+        match: Callable[[Path], bool],
+    ):
+        self.key = key
+        self.paths = list(paths)
+        self.after = after
+        self.match = match
+        # the assets producing its files, and the files no asset produces
+        self.producers: Set[Hashable] = set()
+        self.unproduced: List[Path] = []
+        # the files before this one have been resolved already
+        self._next = 0
+
+
+class DependencyTracker:
+    """
+    Holds back assets compiled from outputs of other assets until every asset
+    producing those files is decided, which is when it has been found up to date,
+    restored or submitted. Keys are (context index, asset id) tuples.
+
+    Assets become ready in waves passed to release. An asset only depends on
+    assets decided before its wave, so the assets of a wave can be batched together.
+    Release is never called with the tracker's lock held, and it is called on one
+    thread at a time.
+    """
+
+    def __init__(self, release: Callable[[Sequence[HeldAsset]], None]):
+        self._release = release
+
+        self._lock = threading.Lock()
+        self._producers: Mapping[Path, Hashable] = {}
+        self._decided: Set[Hashable] = set()
+        self._settled: Set[int] = set()
+        self._finished = False
+
+        self._held: Mapping[Hashable, HeldAsset] = {}
+        self._waiters: Mapping[Any, List[Hashable]] = {}
+        self._matched: Mapping[Any, List[Path]] = {}
+        self._events = []
+        self._draining = False
+
+    def produces(self, key: Hashable, outputs: Sequence[Path]):
+        """
+        Records the files an asset compiles to
+        """
+        with self._lock:
+            for f in outputs:
+                self._producers[f] = key
+            if self._held:
+                self._events += [(_PATH, f) for f in outputs]
+        self._drain()
+
+    def hold(
+        self,
+        key: Hashable,
+        paths: Sequence[Path],
+        after: Sequence[int] = (),
+        match: Callable[[Path], bool] = None,
+    ):
+        """
+        Holds an asset back until the assets producing the given files are decided.
+        With match, the asset also depends on the outputs of the contexts listed in
+        after that match, so it waits for those contexts to be settled first.
+        """
+        with self._lock:
+            self._held[key] = HeldAsset(key, paths, after if match else (), match)
+            self._events.append((_HOLD, key))
+        self._drain()
+
+    def decide(self, key: Hashable):
+        """
+        Records that an asset has been found up to date, restored or submitted
+        """
+        with self._lock:
+            self._decided.add(key)
+            if self._held:
+                self._events.append((_KEY, key))
+        self._drain()
+
+    def settle(self, index: int):
+        """
+        Records that every asset of a context is known and decided, apart from
+        the held ones
+        """
+        with self._lock:
+            self._settled.add(index)
+            self._events.append((_CONTEXT, index))
+        self._drain()
+
+    def finish(self) -> List[Hashable]:
+        """
+        Records that every asset is known, so files without a producer are plain
+        files. Returns the keys of the assets that can't be released because they
+        depend on each other.
+        """
+        with self._lock:
+            self._finished = True
+            self._events.append((_PATH, None))
+        self._drain()
+        with self._lock:
+            return sorted(self._held)
+
+    def _drain(self):
+        with self._lock:
+            if self._draining:
+                return
+            self._draining = True
+
+        try:
+            while True:
+                with self._lock:
+                    if not self._events:
+                        self._draining = False
+                        return
+                    events = self._events
+                    self._events = []
+                    ready = self._wake(events)
+                if ready:
+                    self._release(ready)
+        except BaseException:
+            with self._lock:
+                self._draining = False
+            raise
+
+    def _wake(self, events: Sequence[Any]) -> List[HeldAsset]:
+        candidates = []
+        for event in events:
+            if event == (_PATH, None):
+                # every file still without a producer can be resolved now
+                for blocker in [b for b in self._waiters if b[0] == _PATH]:
+                    candidates += self._waiters.pop(blocker)
+                continue
+            if event[0] == _HOLD:
+                candidates.append(event[1])
+            else:
+                candidates += self._waiters.pop(event, [])
+
+        ready = []
+        for key in dict.fromkeys(candidates):
+            held = self._held.get(key)
+            if held is None:
+                continue
+            blocker = self._blocker(held)
+            if blocker is None:
+                del self._held[key]
+                ready.append(held)
+            else:
+                self._waiters.setdefault(blocker, []).append(key)
+        return ready
+
+    def _blocker(self, held: HeldAsset) -> Any:
+        """
+        Returns what an asset is waiting for, or None if it is ready
+        """
+        if held.match is not None:
+            for index in held.after:
+                if index not in self._settled:
+                    return (_CONTEXT, index)
+            declared = set(held.paths)
+            held.paths += [f for f in self._match(held) if f not in declared]
+            held.match = None
+
+        while held._next < len(held.paths):
+            f = held.paths[held._next]
+            producer = self._producers.get(f)
+            if producer is None:
+                if not self._finished:
+                    return (_PATH, f)
+                held.unproduced.append(f)
+            elif producer != held.key:
+                if producer not in self._decided:
+                    return (_KEY, producer)
+                held.producers.add(producer)
+            held._next += 1
+        return None
+
+    def _match(self, held: HeldAsset) -> List[Path]:
+        # every asset of a context shares the same patterns
+        group = (tuple(held.after), held.match)
+        matched = self._matched.get(group)
+        if matched is None:
+            after = set(held.after)
+            matched = [
+                f
+                for f, producer in self._producers.items()
+                if producer[0] in after and held.match(f)
+            ]
+            self._matched[group] = matched
+        return matched
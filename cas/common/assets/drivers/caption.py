@@ -23,7 +23,9 @@ class CaptionDriver(SerialDriver):
     def compile(self, context: AssetBuildContext, asset: Asset) -> bool:
         args = [str(self.tool), str(asset.path)]
 
-        returncode = self.env.run_tool(args, source=True)
+        returncode = self.env.run_tool(
+            args, source=True, timeout=context.config.get("timeout")
+        )
         return returncode == 0
 
 
@@ -5,9 +5,27 @@ from cas.common.assets.models import (
     PrecompileResult,
 )
 
-from typing import List, Set
+from typing import List, Set, Tuple
 from pathlib import Path
 import os
+import re
+
+# quoted strings, comments, braces and bare words, in the way studiomdl splits them
+_token_regex = re.compile(r'"([^"]*)"|//[^\n]*|/\*.*?\*/|[{}]|([^\s"{}]+)', re.DOTALL)
+
+# commands whose argument is a path, and what it means
+_path_commands = {
+    "$include": "include",
+    "$modelname": "output",
+    "$pushd": "pushd",
+    "$cd": "cd",
+}
+
+# files studiomdl reads meshes, animations and flexes from
+_source_extensions = {".smd", ".dmx", ".vta", ".vrd", ".fbx", ".obj"}
+
+# bump when parsing changes, so cached parses are redone
+_parser_version = 1
 
 
 class ModelDriver(SerialDriver):
@@ -19,38 +37,114 @@ class ModelDriver(SerialDriver):
     def _tool_name(self):
         return "mdlcompile"
 
-    def _deps_searchline(self, token, line, set):
-        line = line.strip()
-        i = line.find(token)
-        if i == -1:
-            return
-        s1 = line.rfind('"', 0, i) + 1
-        s2 = line.find('"', i)
-
-        path = line[s1:s2]
-        set.append(path)
-
-    def _parse_deps_from_vdf(self, path: Path):
+    def _parse_qc(self, path: Path) -> List[Tuple[str, str]]:
         """
-        Walks a QC/MC VDF file and extracts the input and output paths.
+        Tokenizes a QC/MC file into the commands that matter for its dependencies.
+        Paths are kept as written, since they depend on the directory the file
+        is included from.
         """
-        inputs = []
-        outputs = []
-
-        # parse the qc/mc and extract dependent paths
-        with open(str(path), "r") as f:
-            qc = f.readlines()
-
-        for line in qc:
-            # exclude comments and specific strings
-            if line.startswith("//"):
+        with open(path, "r", errors="replace") as f:
+            text = f.read()
+
+        events = []
+        command = None
+        for match in _token_regex.finditer(text):
+            quoted, token = match.group(1), match.group(2)
+            if token is None:
+                if quoted is None:
+                    # comment or brace
+                    continue
+                token = quoted
+            elif token.startswith("$"):
+                command = token.lower()
+                if command == "$popd":
+                    events.append(("popd", ""))
+                    command = None
                 continue
-            if "$includemodel" in line:
-                continue
-            self._deps_searchline("smd", line, inputs)
-            self._deps_searchline("mdl", line, outputs)
 
-        return set(inputs), set(outputs)
+            if command in _path_commands:
+                events.append((_path_commands[command], token))
+                command = None
+            elif command == "$includemodel":
+                # only loaded by the engine at runtime, it isn't compiled in
+                command = None
+            elif os.path.splitext(token)[1].lower() in _source_extensions:
+                events.append(("input", token))
+        return events
+
+    def _cached_parse(self, path: Path) -> List[Tuple[str, str]]:
+        """
+        Parses a QC/MC file unless a parse of the same contents is cached.
+        Like the file cache, files whose size and timestamps are unchanged aren't
+        even hashed.
+        """
+        key = os.path.relpath(path, self.env.root).replace("\\", "/")
+        cache = self.env.cache.namespace("drivers/model")
+        entry = cache.get(key)
+        if entry is not None and entry["version"] != _parser_version:
+            entry = None
+
+        st = os.stat(path)
+        signature = [st.st_size, st.st_mtime_ns, st.st_ino]
+        if entry is not None and not self.env.cache.paranoid:
+            if entry.get("signature") == signature:
+                return entry["events"]
+
+        algorithm = self.env.cache.hash_algorithm
+        digest = self.env.fingerprints.digest(path, algorithm, st)
+        if entry is not None and entry["hash"] == digest:
+            events = entry["events"]
+        else:
+            events = self._parse_qc(path)
+        cache[key] = {
+            "version": _parser_version,
+            "hash": digest,
+            "signature": signature,
+            "events": events,
+        }
+        return events
+
+    def _collect_deps(
+        self,
+        path: Path,
+        dirs: List[Path],
+        inputs: Set[Path],
+        outputs: Set[Path],
+        chain: Set[Path],
+    ):
+        """
+        Follows the commands of a QC/MC file and everything it includes.
+        dirs is the stack of directories paths are relative to, like studiomdl's.
+        """
+        chain = chain | {path}
+        for kind, arg in self._cached_parse(path):
+            # QCs written on Windows often use backslashes
+            arg = arg.replace("\\", "/")
+            if kind == "output":
+                outputs.add(Path(arg if Path(arg).suffix else f"{arg}.mdl"))
+            elif kind == "popd":
+                if len(dirs) > 1:
+                    dirs.pop()
+            elif kind == "pushd":
+                dirs.append(dirs[-1].joinpath(arg))
+            elif kind == "cd":
+                dirs[-1] = dirs[-1].joinpath(arg)
+            else:
+                f = Path(os.path.normpath(dirs[-1].joinpath(arg)))
+                inputs.add(f)
+                # missing includes are reported as missing dependencies later
+                if kind == "include" and f not in chain and f.is_file():
+                    self._collect_deps(f, dirs, inputs, outputs, chain)
+
+    def _parse_deps_from_vdf(self, path: Path) -> Tuple[Set[Path], Set[Path]]:
+        """
+        Walks a QC/MC VDF file and the files it includes, and extracts the input
+        and output paths. Outputs are relative to the models folder.
+        """
+        inputs = set()
+        outputs = set()
+        self._collect_deps(path, [path.parent], inputs, outputs, set())
+        return inputs, outputs
 
     def _convert_relpaths(self, root: Path, paths: Set[Path]) -> Set[Path]:
         result = set()
@@ -64,7 +158,6 @@ class ModelDriver(SerialDriver):
         gamedir = gamedir.replace("\\", "/").split("/")[1]
 
         inputs, outputs = self._parse_deps_from_vdf(asset.path)
-        inputs = self._convert_relpaths(asset.path.parent, inputs)
         outputs = self._convert_relpaths(
             self.env.game.joinpath(gamedir, "models"), outputs
         )
@@ -82,7 +175,9 @@ class ModelDriver(SerialDriver):
     def compile(self, context: AssetBuildContext, asset: Asset) -> bool:
         args = [str(self.tool), str(asset.path)]
 
-        returncode = self.env.run_tool(args, source=True)
+        returncode = self.env.run_tool(
+            args, source=True, timeout=context.config.get("timeout")
+        )
         return returncode == 0
 
 
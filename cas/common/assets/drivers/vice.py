@@ -31,7 +31,9 @@ class ViceDriver(BatchedDriver):
         for asset in assets:
             args.append(str(asset.path))
 
-        result = self.env.run_tool(args, source=True)
+        result = self.env.run_tool(
+            args, source=True, timeout=context.config.get("timeout")
+        )
         return result == 0
 
 
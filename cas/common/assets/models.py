@@ -1,14 +1,24 @@
 from cas.common.models import BuildEnvironment
 
-import uuid
+import os
 from pathlib import Path
-from typing import List, Set
+from typing import List, Optional, Set
 
 
 class PrecompileResult:
-    def __init__(self, inputs: Set[Path], outputs: Set[Path]):
+    """
+    The files an asset is compiled from and the files it compiles to.
+    Files that are outputs of other assets go in depends, so the asset is compiled
+    after those assets, and again whenever they are. Unlike inputs, they don't
+    have to exist before the build.
+    """
+
+    def __init__(
+        self, inputs: Set[Path], outputs: Set[Path], depends: Set[Path] = None
+    ):
         self.inputs = inputs
         self.outputs = outputs
+        self.depends = depends if depends is not None else set()
 
 
 class AssetBuildContext:
@@ -19,21 +29,46 @@ class AssetBuildContext:
     def __init__(self, config: dict):
         self.assets = []
         self.config = config
+        # scheduling limits from the driver options
+        self.max_concurrency = None
+        self.memory = 0
+
+
+def _relative_id(path: Path, root: Path) -> str:
+    # slicing is much faster than os.path.relpath, and assets are nearly always
+    # inside the project
+    text = str(path)
+    prefix = os.path.join(str(root), "")
+    if text.startswith(prefix):
+        text = text[len(prefix) :]
+    else:
+        try:
+            text = os.path.relpath(text, root)
+        except ValueError:
+            # on another drive than the project
+            pass
+    return text.replace(os.sep, "/") if os.sep != "/" else text
 
 
 class Asset:
     """
-    Represents an asset to be compiled
+    Represents an asset to be compiled.
+    Projects can have hundreds of thousands of these, so the record is slotted and
+    configuration is shared through the context the asset belongs to.
     """
 
-    def __init__(self, path: Path, config: dict):
-        self.id = uuid.uuid4()
+    __slots__ = ("id", "path", "outpath")
+
+    def __init__(self, path: Path, root: Path):
+        # derived from the path, so it is the same in every run and process
+        self.id = _relative_id(path, root)
         self.path = path
-        self.config = config
+        # the main output file, for drivers that have one
+        self.outpath: Optional[Path] = None
 
-    def get_id(self):
+    def get_id(self) -> str:
         """
-        Returns the unique identifier for this asset
+        Returns the identifier of this asset, its path relative to the project root
         """
         return self.id
 
@@ -56,6 +91,13 @@ class BaseDriver:
         """
         return True
 
+    def cpu_bound(self) -> bool:
+        """
+        Whether this driver does CPU heavy work in Python rather than waiting on an external tool.
+        CPU bound drivers run in worker processes, the others run on threads.
+        """
+        return False
+
     def precompile(self, context: AssetBuildContext, asset: Asset) -> PrecompileResult:
         """
         Checks to ensure all required files are present
@@ -74,6 +116,20 @@ class SerialDriver(BaseDriver):
 
 
 class BatchedDriver(BaseDriver):
+    def max_batch_size(self) -> int:
+        """
+        The maximum number of assets passed to a single compile_all call
+        """
+        return 256
+
+    def max_batch_args(self) -> int:
+        """
+        The maximum combined length of the asset paths passed to a single compile_all call,
+        which keeps the tool's command line under the OS limit
+        """
+        # leave room for the tool and its options under the Windows limit of 32767
+        return 30000
+
     def compile_all(self, context: AssetBuildContext, assets: List[Asset]) -> bool:
         """
         Performs the compile
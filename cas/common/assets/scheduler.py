@@ -0,0 +1,569 @@
+import cas.common.utilities as utilities
+from cas.common.models import BuildEnvironment
+from cas.common.jobserver import Jobserver
+from cas.common.assets.models import Asset, AssetBuildContext, BatchedDriver
+
+import os
+import gc
+import time
+import heapq
+import itertools
+import queue
+import collections
+import logging
+import threading
+import multiprocessing
+
+from multiprocessing.pool import ThreadPool
+from multiprocessing.queues import Queue
+from multiprocessing.synchronize import Lock
+from typing import Callable, List, Mapping, Optional, Sequence, Set, Tuple
+from pathlib import Path
+
+# set up our process shared logger and the contexts each worker builds from
+lock: Lock = None
+logger: logging.Logger = None
+events: Queue = None
+worker_contexts: Sequence[AssetBuildContext] = None
+
+# the lanes a job can run on
+SERIAL = "serial"
+THREAD = "thread"
+PROCESS = "process"
+
+# control messages for the scheduler's inbox
+_CLOSE = object()
+_CANCEL = object()
+
+
+def _async_mod_init(
+    _lock: Lock, _events: Queue, _contexts: Sequence[AssetBuildContext]
+):
+    global lock, logger, events, worker_contexts
+    lock = _lock
+    logger = multiprocessing.get_logger()
+    events = _events
+    worker_contexts = _contexts
+
+
+def _run_async_job(job: Tuple[int, str, Sequence[str]]) -> Tuple[str, bool, float]:
+    index, key, paths = job
+    context = worker_contexts[index]
+    driver = context.driver
+    assets = [Asset(Path(path), driver.env.root) for path in paths]
+
+    context.logger = logger
+    if not context.logger:
+        context.logger = logging.getLogger(driver.__class__.__module__)
+
+    with lock:
+        for asset in assets:
+            relpath = os.path.relpath(asset.path, driver.env.root)
+            context.logger.info(f"Compiling {str(relpath)}")
+    start = time.time()
+    events.put((key, start))
+
+    try:
+        if isinstance(driver, BatchedDriver):
+            success = driver.compile_all(context, assets)
+        else:
+            success = driver.compile(context, assets[0])
+    except Exception:
+        with lock:
+            context.logger.exception("  Exception raised by the driver")
+        success = False
+
+    if not success:
+        with lock:
+            for asset in assets:
+                relpath = os.path.relpath(asset.path, driver.env.root)
+                context.logger.error(f"  Failed compile {str(relpath)}")
+    return key, success, time.time() - start
+
+
+class AssetJob:
+    """
+    One or more assets of a context that are compiled together
+    """
+
+    def __init__(self, index: int, key: str, assets: Sequence[Asset], lane: str):
+        self.index = index
+        self.key = key
+        self.assets = assets
+        self.lane = lane
+        # how long the job took last time, if it is known
+        self.expected: Optional[float] = None
+        # how long the job is estimated to take, used to order jobs
+        self.estimate: float = 0.0
+        # the driver type, how many jobs of it may run at once and how many
+        # megabytes of memory one of its jobs is expected to use
+        self.driver: Optional[str] = None
+        self.max_concurrency: Optional[int] = None
+        self.memory: int = 0
+        # keys of the jobs that have to succeed before this one can start
+        self.depends: Set[str] = set()
+
+    def descriptor(self) -> Tuple[int, str, Sequence[str]]:
+        """
+        Returns the compact form of the job that is sent to workers
+        """
+        return self.index, self.key, [str(asset.path) for asset in self.assets]
+
+
+class _StragglerMonitor:
+    """
+    Warns about jobs that run far longer than their assets took historically
+    """
+
+    def __init__(self, root: Path, factor: float, logger: logging.Logger):
+        self._root = root
+        self._factor = factor
+        self._logger = logger
+        self._started = {}
+
+    def started(self, job: AssetJob, start: float):
+        if job.expected is not None:
+            self._started[job.key] = (job, start)
+
+    def finished(self, job: AssetJob):
+        self._started.pop(job.key, None)
+
+    def check(self):
+        now = time.time()
+        for key, (job, start) in list(self._started.items()):
+            elapsed = now - start
+            if elapsed > max(job.expected * self._factor, 10):
+                relpath = os.path.relpath(job.assets[0].path, self._root)
+                self._logger.warning(
+                    f"{relpath} has been compiling for {elapsed:.0f}s, it usually takes {job.expected:.0f}s"
+                )
+                # only warn once per job
+                del self._started[key]
+
+
+class _Resources:
+    """
+    Tracks what the running jobs hold, and decides whether another job may start
+    """
+
+    def __init__(self, threads: int, budget: Optional[int], live: bool):
+        self.threads = threads
+        self.budget = budget
+        self.live = live
+
+        self.running = 0
+        self.serial = False
+        self.drivers = collections.Counter()
+        self.memory = 0
+
+        self._available = None
+        self._checked = 0.0
+
+    def _available_memory(self) -> Optional[int]:
+        # /proc/meminfo is cheap to read, but not cheap enough to read for every job
+        now = time.monotonic()
+        if now - self._checked >= 1:
+            self._available = utilities.get_available_memory()
+            self._checked = now
+        return self._available
+
+    def admits(self, job: AssetJob) -> bool:
+        if self.running >= self.threads:
+            return False
+        if job.lane == SERIAL and self.serial:
+            return False
+        if (
+            job.max_concurrency is not None
+            and self.drivers[job.driver] >= job.max_concurrency
+        ):
+            return False
+
+        # always let one job through, even if it's bigger than the whole budget
+        if self.running == 0 or job.memory <= 0:
+            return True
+        if self.budget is not None and self.memory + job.memory > self.budget:
+            return False
+        if self.live:
+            # back off while something outside the build is eating into memory
+            available = self._available_memory()
+            if available is not None and job.memory > available:
+                return False
+        return True
+
+    def acquire(self, job: AssetJob):
+        self.running += 1
+        self.serial = self.serial or job.lane == SERIAL
+        self.drivers[job.driver] += 1
+        self.memory += job.memory
+        # the job hasn't allocated anything yet, so measure again next time
+        self._checked = 0.0
+
+    def release(self, job: AssetJob):
+        self.running -= 1
+        if job.lane == SERIAL:
+            self.serial = False
+        self.drivers[job.driver] -= 1
+        self.memory -= job.memory
+
+
+class AssetScheduler:
+    """
+    Runs asset jobs on a serial lane, a thread pool and a process pool at the same time.
+    All lanes draw from the same thread budget, so the total number of running jobs
+    never exceeds it.
+    Jobs are also held back while their driver is at its concurrency limit, or while
+    they would push the build over its memory budget.
+    Otherwise the longest jobs start first, so a slow job doesn't end up
+    holding up the end of the build on its own.
+    Jobs depending on other jobs wait until those succeed, and are skipped if one fails.
+    """
+
+    def __init__(
+        self,
+        contexts: Sequence[AssetBuildContext],
+        threads: int,
+        fail_fast: bool,
+        straggler_factor: float,
+        root: Path,
+        logger: logging.Logger,
+        memory_budget: Optional[int] = None,
+        jobserver: Optional[Jobserver] = None,
+    ):
+        self._contexts = contexts
+        self._threads = max(1, threads)
+        self._fail_fast = fail_fast
+        self._logger = logger
+        self._stragglers = _StragglerMonitor(root, straggler_factor, logger)
+
+        if memory_budget is None:
+            memory_budget = utilities.get_available_memory()
+        self._memory_budget = memory_budget
+        self._resources = _Resources(self._threads, memory_budget, True)
+        self._jobserver = jobserver
+        # keys of the running jobs that hold a jobserver token
+        self._tokens = set()
+
+        # pending jobs of each context, as heaps of (-estimate, submission order, job).
+        # jobs of a context share a lane and limits, so only the head of each needs checking
+        self._pending: Mapping[int, List[Tuple[float, int, AssetJob]]] = {}
+        self._order = itertools.count()
+        self._submitted: List[AssetJob] = []
+        self._running: Mapping[str, AssetJob] = {}
+        self._lanes = {}
+
+        # jobs waiting for their dependencies, with the number of them still unfinished,
+        # the waiting jobs of each dependency and how the finished jobs went
+        self._blocked: Mapping[str, int] = {}
+        self._waiters: Mapping[str, List[AssetJob]] = {}
+        self._succeeded: Set[str] = set()
+        self._failed: Set[str] = set()
+
+        # everything that happens on other threads reaches the dispatcher through here:
+        # new jobs, finished jobs, jobserver tokens and the end of the input
+        self._inbox = queue.SimpleQueue()
+        self._open = True
+
+        self._local_events = queue.SimpleQueue()
+        self._process_events = None
+
+    def submit(self, job: AssetJob):
+        """
+        Adds a job to run. Jobs may be submitted from any thread, also while running.
+        """
+        self._inbox.put(job)
+
+    def close(self):
+        """
+        Signals that no more jobs will be submitted, so run returns once all jobs finish
+        """
+        self._inbox.put(_CLOSE)
+
+    def cancel(self):
+        """
+        Drops the jobs that haven't started yet and lets the running ones finish
+        """
+        self._inbox.put(_CANCEL)
+
+    def _queue(self, job: AssetJob):
+        heap = self._pending.setdefault(job.index, [])
+        heapq.heappush(heap, (-job.estimate, next(self._order), job))
+
+    def _admit(self, job: AssetJob) -> bool:
+        """
+        Queues a submitted job, or holds it back until its dependencies succeed.
+        Returns False if one of them already failed.
+        """
+        self._submitted.append(job)
+        unfinished = job.depends - self._succeeded
+        if unfinished & self._failed:
+            return False
+        if not unfinished:
+            self._queue(job)
+            return True
+
+        self._blocked[job.key] = len(unfinished)
+        for key in unfinished:
+            self._waiters.setdefault(key, []).append(job)
+        return True
+
+    def _resolve(self, key: str, success: bool) -> List[AssetJob]:
+        """
+        Records how a job went and queues the jobs that were only waiting for it.
+        Returns the waiting jobs that can't run anymore, as it failed.
+        """
+        (self._succeeded if success else self._failed).add(key)
+        skipped = []
+        for job in self._waiters.pop(key, []):
+            # skipped or cancelled already
+            if job.key not in self._blocked:
+                continue
+            if not success:
+                del self._blocked[job.key]
+                skipped.append(job)
+                continue
+            self._blocked[job.key] -= 1
+            if self._blocked[job.key] == 0:
+                del self._blocked[job.key]
+                self._queue(job)
+        return skipped
+
+    def _finish(
+        self,
+        complete: Callable[[AssetJob, bool, float], None],
+        job: AssetJob,
+        success: bool,
+        elapsed: float,
+    ):
+        """
+        Completes a job, along with the jobs that depend on it if it failed
+        """
+        finished = [(job, success, elapsed)]
+        while finished:
+            job, success, elapsed = finished.pop()
+            complete(job, success, elapsed)
+            for skipped in self._resolve(job.key, success):
+                self._skip(skipped)
+                finished.append((skipped, False, 0.0))
+
+    def _skip(self, job: AssetJob):
+        ids = ", ".join(asset.get_id() for asset in job.assets)
+        self._logger.error(f"  Skipping {ids}, an asset it depends on failed")
+
+    def _next_queue(
+        self, resources: _Resources, pending
+    ) -> Optional[List[Tuple[float, int, AssetJob]]]:
+        """
+        Picks the queue to start a job from. The serial lane goes first so it runs
+        alongside the pools instead of waiting for them to drain, otherwise the queue
+        with the longest admissible job wins.
+        """
+        queues = [
+            heap for heap in pending.values() if heap and resources.admits(heap[0][2])
+        ]
+        if not queues:
+            return None
+        return min(queues, key=lambda heap: (heap[0][2].lane != SERIAL, heap[0]))
+
+    def predict_makespan(self, jobs: Sequence[AssetJob]) -> float:
+        """
+        Replays the dispatch order against the job estimates to predict how long
+        the jobs would take to build, had they all been known from the start
+        """
+        keys = {job.key for job in jobs}
+        pending = {}
+        blocked = {}
+        waiters = {}
+        for order, job in enumerate(jobs):
+            depends = job.depends & keys
+            if not depends:
+                heapq.heappush(
+                    pending.setdefault(job.index, []), (-job.estimate, order, job)
+                )
+                continue
+            blocked[job.key] = len(depends)
+            for key in depends:
+                waiters.setdefault(key, []).append((order, job))
+        resources = _Resources(self._threads, self._memory_budget, False)
+        running = []
+        now = 0.0
+        while True:
+            while True:
+                heap = self._next_queue(resources, pending)
+                if heap is None:
+                    break
+                _, order, job = heapq.heappop(heap)
+                resources.acquire(job)
+                heapq.heappush(running, (now + job.estimate, order, job))
+            if not running:
+                return now
+            now, _, job = heapq.heappop(running)
+            resources.release(job)
+            for order, waiter in waiters.get(job.key, ()):
+                blocked[waiter.key] -= 1
+                if blocked[waiter.key] == 0:
+                    heapq.heappush(
+                        pending.setdefault(waiter.index, []),
+                        (-waiter.estimate, order, waiter),
+                    )
+
+    def _lane_pool(self, lane: str) -> ThreadPool:
+        pool = self._lanes.get(lane)
+        if pool is not None:
+            return pool
+
+        if lane == PROCESS:
+            self._process_events = multiprocessing.Queue()
+            pool = multiprocessing.Pool(
+                self._threads,
+                initializer=_async_mod_init,
+                initargs=(
+                    multiprocessing.Lock(),
+                    self._process_events,
+                    self._contexts,
+                ),
+            )
+        else:
+            # jobs on the serial lane and the thread pool run in this process
+            _async_mod_init(threading.Lock(), self._local_events, self._contexts)
+            pool = ThreadPool(1 if lane == SERIAL else self._threads)
+
+        self._lanes[lane] = pool
+        return pool
+
+    def _dispatch(self):
+        while True:
+            heap = self._next_queue(self._resources, self._pending)
+            if heap is None:
+                return
+
+            # the first running job uses our implicit slot, the others need a token
+            token = len(self._running) > len(self._tokens)
+            if token and self._jobserver is not None:
+                if not self._jobserver.try_acquire(lambda: self._inbox.put(None)):
+                    return
+                self._tokens.add(heap[0][2].key)
+
+            _, _, job = heapq.heappop(heap)
+            self._resources.acquire(job)
+
+            def failed(exc: BaseException, key: str = job.key):
+                self._logger.error(f"  Failed to run job: {exc}")
+                self._inbox.put((key, False, 0.0))
+
+            self._lane_pool(job.lane).apply_async(
+                _run_async_job,
+                (job.descriptor(),),
+                callback=self._inbox.put,
+                error_callback=failed,
+            )
+            self._running[job.key] = job
+
+    def _release_token(self, key: str):
+        if key in self._tokens:
+            self._tokens.discard(key)
+            self._jobserver.release()
+
+    def _drain_events(self):
+        for events in (self._local_events, self._process_events):
+            while events is not None and not events.empty():
+                key, start = events.get()
+                job = self._running.get(key)
+                if job is not None:
+                    self._stragglers.started(job, start)
+
+    def _terminate(self):
+        # threads can't be killed, so stop the tools they are waiting on first
+        BuildEnvironment.terminate_tools()
+        for pool in self._lanes.values():
+            pool.terminate()
+
+    def run(self, complete: Callable[[AssetJob, bool, float], None]) -> bool:
+        """
+        Runs jobs until the scheduler is closed and every job has finished,
+        calling complete on this thread as each one finishes.
+        Returns True if all jobs succeeded.
+        """
+        if self._memory_budget is not None:
+            self._logger.debug(f"memory budget is {self._memory_budget} MB")
+        start = time.time()
+
+        success = True
+        try:
+            while (
+                self._open
+                or self._running
+                or any(self._pending.values())
+                or self._blocked
+            ):
+                if not (self._open or self._running or any(self._pending.values())):
+                    # nothing left that could finish their dependencies
+                    self._logger.error(
+                        f"{len(self._blocked)} job(s) depend on jobs that never ran"
+                    )
+                    self._blocked = {}
+                    success = False
+                    break
+                self._dispatch()
+                self._drain_events()
+                self._stragglers.check()
+
+                try:
+                    message = self._inbox.get(timeout=1)
+                except queue.Empty:
+                    continue
+
+                if isinstance(message, AssetJob):
+                    if not self._admit(message):
+                        self._skip(message)
+                        self._finish(complete, message, False, 0.0)
+                        success = False
+                    continue
+                if message is _CLOSE:
+                    self._open = False
+                    continue
+                if message is _CANCEL:
+                    self._open = False
+                    self._pending = {}
+                    self._blocked = {}
+                    continue
+                # a jobserver token arrived
+                if message is None:
+                    continue
+
+                key, result, elapsed = message
+                job = self._running.pop(key)
+                self._resources.release(job)
+                self._release_token(key)
+                self._stragglers.finished(job)
+                self._finish(complete, job, result, elapsed)
+                success = success and result
+                if not success and self._fail_fast:
+                    self._logger.error("stopping the build after the first failure")
+                    self._terminate()
+                    break
+        except KeyboardInterrupt:
+            self._terminate()
+            raise
+        finally:
+            for pool in self._lanes.values():
+                pool.close()
+                pool.join()
+            # daemons and watch mode create a scheduler per build, and the pipes
+            # pools hold are only closed once the cycle collector finalizes them
+            if self._process_events is not None:
+                self._process_events.close()
+                self._process_events.join_thread()
+            if self._lanes:
+                self._lanes.clear()
+                gc.collect()
+            for key in list(self._tokens):
+                self._release_token(key)
+            if self._jobserver is not None:
+                self._jobserver.close()
+
+        if self._submitted:
+            predicted = self.predict_makespan(self._submitted)
+            self._logger.info(
+                f"predicted build time {predicted:.1f}s, actual {time.time() - start:.1f}s"
+            )
+        return success
@@ -31,6 +31,9 @@ class BaseCompileEnvironment:
     Base compilation environment
     """
 
+    # whether commands run here can inherit the jobserver pipe
+    jobserver = False
+
     def __init__(self, env: BuildEnvironment, config: Mapping):
         self._env = env
         self._config = config
@@ -64,6 +67,8 @@ class NativeCompileEnvironment(BaseCompileEnvironment):
     Compilation environment that executes commands in a native shell
     """
 
+    jobserver = True
+
     def run(
         self, args: List[str], env: Mapping[str, str] = {}, path_suffix: str = None
     ) -> int:
@@ -73,7 +78,10 @@ class NativeCompileEnvironment(BaseCompileEnvironment):
             cwd += f"/{path_suffix}"
         print(cwd)
         return self._env.run_subprocess(
-            args, env=self._build_env(env), cwd=cwd
+            args,
+            env=self._build_env(env),
+            cwd=cwd,
+            pass_fds=self._env.jobserver.fds(),
         ).returncode
 
 
@@ -82,6 +90,8 @@ class ChrootCompileEnvironment(BaseCompileEnvironment):
     Compilation environment that executes commands using schroot
     """
 
+    jobserver = True
+
     def run(
         self, args: List[str], env: Mapping[str, str] = {}, path_suffix: str = None
     ) -> int:
@@ -89,7 +99,10 @@ class ChrootCompileEnvironment(BaseCompileEnvironment):
         defargs = ["schroot", "-c", self._env_config.name, "--", "bash", "-c"]
 
         return self._env.run_subprocess(
-            defargs.extend(args), env=self._build_env(env), cwd=cwd
+            defargs.extend(args),
+            env=self._build_env(env),
+            cwd=cwd,
+            pass_fds=self._env.jobserver.fds(),
         ).returncode
 
 
@@ -261,16 +274,10 @@ class PosixCompiler(BaseCompiler):
         return self._run_makefile("Makefile", args, "utils/vpc")
 
     def _run_makefile(self, file: str, args: List[str], path_suffix: None) -> bool:
-        jobs = self._config.get("jobs", multiprocessing.cpu_count())
+        jobs = self._config.get("jobs")
+        jobserver = self._env.jobserver
         sanitizers = self._config.sanitizers
 
-        args = [
-            "make",
-            "-f",
-            file,
-            f"-j{jobs}",
-        ] + args
-
         envvars = {
             "CFG": self._build_type,
             "ASAN": sanitizers.address,
@@ -281,6 +288,15 @@ class PosixCompiler(BaseCompiler):
             "VALVE_NO_AUTO_P4": True,
         }
 
+        if jobs is None and jobserver.enabled and self._compile_env.jobserver:
+            # draw job slots from the same pool as everything else
+            args = ["make", "-f", file] + args
+            envvars["MAKEFLAGS"] = jobserver.makeflags()
+        else:
+            if jobs is None:
+                jobs = multiprocessing.cpu_count()
+            args = ["make", "-f", file, f"-j{jobs}"] + args
+
         return (
             self._compile_env.run(args, utilities.map_to_envvars(envvars), path_suffix)
             == 0
@@ -1,5 +1,4 @@
 import logging
-import itertools
 import cas.common.utilities as utilities
 from cas.common.models import BuildEnvironment
 from cas.common.config import LazyDynamicDotMap
@@ -60,17 +59,12 @@ class VPCInstance:
         self._group = config.group
         self._platform = platform
 
-        self._cache = self._env.cache["vpc"]
-        if "files" not in self._cache:
-            self._cache["files"] = {}
-
-        self._file_cache = FileCache(self._env.cache, self._cache["files"])
+        self._cache = self._env.cache.namespace("vpc")
+        self._file_cache = FileCache(self._env.cache, self._cache.namespace("files"))
         self._logger = logging.getLogger(__name__)
 
     def _list_all_vpcs(self) -> list:
-        return itertools.chain(
-            self._env.src.rglob("*.vpc"), self._env.src.rglob("*.vgc")
-        )
+        return list(self._env.scanner.glob(self._env.src, ["*.vpc", "*.vgc"]))
 
     def _process_vpc_args(self) -> VPCArguments:
         args = list(self._config.args)
@@ -100,7 +94,7 @@ class VPCInstance:
         # Don't do this on Windows, it's an unnecessary slowdown
         if utilities.is_platform_windows():
             return
-        crc_files = self._env.src.rglob("*.vpc_crc")
+        crc_files = self._env.scanner.glob(self._env.src, ["*.vpc_crc"])
         for f in crc_files:
             f.unlink()
 
@@ -108,11 +102,11 @@ class VPCInstance:
         args = self._process_vpc_args()
 
         # hash the VPC files
-        vpc_files = self._list_all_vpcs()
-        for f in vpc_files:
-            if not self._file_cache.validate(f):
-                self._file_cache.put(f)
-                rebuild = True
+        valid = self._file_cache.validate_many(self._list_all_vpcs())
+        changed = [f for f, v in valid.items() if not v]
+        if changed:
+            self._file_cache.put_many(changed)
+            rebuild = True
 
         if rebuild:
             self._file_cache.garbage_collect()
@@ -140,7 +134,7 @@ class VPCInstance:
 
         # ensure cache is invalidated if vpc fails
         if not ret == 0:
-            self._env.cache.vpc = {}
+            self._file_cache.clear()
             self._env.cache.save()
             return False
         return True
@@ -1,70 +1,487 @@
 import cas.common.utilities as utilities
+from cas.common.fingerprint import FingerprintService
 
 import json
 import os
+import sqlite3
+import logging
+import tempfile
+import threading
+import multiprocessing
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Mapping
+from typing import Any, Iterable, Iterator, Mapping, Optional, Sequence, Tuple
 
-from dotmap import DotMap
+# hashing is mostly I/O bound and hashlib releases the GIL, so oversubscribe the CPUs a little
+_hash_workers = min(32, multiprocessing.cpu_count() + 4)
+
+
+class CacheChanges:
+    """
+    Pending modifications to a single cache namespace
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self.cleared = False
+        self.upserts = {}
+        self.deletes = set()
+
+
+class CacheBackend:
+    """
+    Persistent storage for cache namespaces.
+    Namespaces are loaded whole on first use and written back entry by entry.
+    """
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def exists(self) -> bool:
+        raise NotImplementedError()
+
+    def load(self, namespace: str) -> Mapping[str, Any]:
+        """
+        Returns every entry stored in the namespace
+        """
+        raise NotImplementedError()
+
+    def commit(self, changes: Sequence[CacheChanges]):
+        """
+        Persists the pending changes of one or more namespaces
+        """
+        raise NotImplementedError()
+
+
+class JsonCacheBackend(CacheBackend):
+    """
+    Stores the whole cache in a single JSON document.
+    Commits merge into the latest document on disk and atomically replace it.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._data = None
+
+    @staticmethod
+    def _flatten_legacy(data: Mapping, prefix: str, result: dict):
+        # older caches nested namespaces inside each other and stored file hashes under "files"
+        entries = {}
+        for k, v in data.items():
+            if isinstance(v, Mapping) and prefix.rsplit("/", 1)[-1] != "files":
+                _prefix = f"{prefix}/{k}" if prefix else k
+                JsonCacheBackend._flatten_legacy(v, _prefix, result)
+            else:
+                entries[k] = v
+        if entries:
+            result[prefix] = entries
+
+    def _read(self) -> dict:
+        if self._data is not None:
+            return self._data
+
+        self._data = {}
+        if self._path.exists():
+            with open(self._path, "r") as f:
+                data = json.loads(f.read())
+            if "namespaces" in data:
+                self._data = data["namespaces"]
+            else:
+                JsonCacheBackend._flatten_legacy(data, "", self._data)
+        return self._data
+
+    def exists(self) -> bool:
+        return self._path.exists()
+
+    def namespaces(self) -> Mapping[str, Mapping[str, Any]]:
+        return self._read()
+
+    def load(self, namespace: str) -> Mapping[str, Any]:
+        return dict(self._read().get(namespace, {}))
+
+    def commit(self, changes: Sequence[CacheChanges]):
+        # re-read so changes made by other processes since we loaded are kept
+        self._data = None
+        data = self._read()
+        for change in changes:
+            entries = data.setdefault(change.namespace, {})
+            if change.cleared:
+                entries.clear()
+            for k in change.deletes:
+                entries.pop(k, None)
+            entries.update(change.upserts)
+
+        # write to a temporary file first so a crash never leaves a truncated cache
+        fd, tmp = tempfile.mkstemp(dir=self._path.parent, prefix=self._path.name)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps({"namespaces": data}))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+class SqliteCacheBackend(CacheBackend):
+    """
+    Stores cache entries as individual rows in a SQLite database running in WAL mode
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._conn = None
+
+    def open(self):
+        # access is serialised by the cache manager, transactions are managed by us
+        self._conn = sqlite3.connect(
+            str(self._path), timeout=60, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def exists(self) -> bool:
+        return self._path.exists()
+
+    def load(self, namespace: str) -> Mapping[str, Any]:
+        cursor = self._conn.execute(
+            "SELECT key, value FROM entries WHERE namespace = ?", (namespace,)
+        )
+        return {k: json.loads(v) for k, v in cursor}
+
+    def commit(self, changes: Sequence[CacheChanges]):
+        # take the write lock up front, so concurrent writers wait for each other
+        # instead of failing to upgrade a read transaction
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for change in changes:
+                if change.cleared:
+                    self._conn.execute(
+                        "DELETE FROM entries WHERE namespace = ?", (change.namespace,)
+                    )
+                self._conn.executemany(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ?",
+                    ((change.namespace, k) for k in change.deletes),
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value) VALUES (?, ?, ?)",
+                    (
+                        (change.namespace, k, json.dumps(v))
+                        for k, v in change.upserts.items()
+                    ),
+                )
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+
+class CacheNamespace(MutableMapping):
+    """
+    A lazily loaded key-value collection inside the cache.
+    Values must be JSON serialisable and are written back when the manager is saved.
+    """
+
+    def __init__(self, manager: "CacheManager", name: str):
+        self._manager = manager
+        self.name = name
+
+        self._entries = None
+        self._changes = CacheChanges(name)
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            with self._manager._lock:
+                if self._entries is None:
+                    self._entries = dict(self._manager._backend.load(self.name))
+        return self._entries
+
+    def namespace(self, name: str) -> "CacheNamespace":
+        """
+        Returns a namespace nested inside this one
+        """
+        return self._manager.namespace(f"{self.name}/{name}")
+
+    def __getitem__(self, key: str):
+        return self._load()[key]
+
+    def __setitem__(self, key: str, value):
+        # changes are taken by save, which may run on another thread
+        with self._manager._lock:
+            self._load()[key] = value
+            self._changes.upserts[key] = value
+            self._changes.deletes.discard(key)
+
+    def __delitem__(self, key: str):
+        with self._manager._lock:
+            del self._load()[key]
+            self._changes.upserts.pop(key, None)
+            self._changes.deletes.add(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._load())
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def __contains__(self, key) -> bool:
+        return key in self._load()
+
+    def clear(self):
+        with self._manager._lock:
+            self._entries = {}
+            self._changes = CacheChanges(self.name)
+            self._changes.cleared = True
+
+    def _take_changes(self) -> CacheChanges:
+        changes = self._changes
+        self._changes = CacheChanges(self.name)
+        if changes.cleared or changes.upserts or changes.deletes:
+            return changes
+        return None
+
+
+_cache_backends = {"sqlite": SqliteCacheBackend, "json": JsonCacheBackend}
+_cache_files = {"sqlite": ".cas_cache.db", "json": ".cas_cache.json"}
 
 
 class CacheManager:
-    def __init__(self, root: Path):
+    def __init__(
+        self,
+        root: Path,
+        paranoid: bool = False,
+        backend: str = "sqlite",
+        fingerprints: FingerprintService = None,
+        hash_algorithm: str = "sha256",
+    ):
         self._root = root
-        self._file = root.joinpath("content", ".cas_cache.json")
-        self._caches = DotMap()
+        self.paranoid = paranoid
+        self.hash_algorithm = hash_algorithm
+        self.fingerprints = fingerprints or FingerprintService()
+
+        self._backend_type = backend
+        self._file = root.joinpath("content", _cache_files[backend])
+        self._lock_file = root.joinpath("content", ".cas_cache.lock")
+        self._backend = _cache_backends[backend](self._file)
+        self._namespaces = {}
+        self._lock = threading.RLock()
+        self._logger = logging.getLogger(__name__)
+
+    def __getstate__(self):
+        # the backend holds open handles and namespaces are only used by the main process
+        state = self.__dict__.copy()
+        state["_backend"] = None
+        state["_namespaces"] = {}
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _migrate_legacy(self):
+        legacy_file = self._root.joinpath("content", _cache_files["json"])
+        if legacy_file == self._file or not legacy_file.exists():
+            return
+
+        self._logger.info(
+            f"migrating {legacy_file.name} to the {self._backend_type} cache"
+        )
+        changes = []
+        for name, entries in JsonCacheBackend(legacy_file).namespaces().items():
+            change = CacheChanges(name)
+            change.upserts = entries
+            changes.append(change)
+        self._backend.commit(changes)
+        os.replace(legacy_file, legacy_file.with_suffix(".json.bak"))
 
     def load(self):
-        if os.path.exists(self._file):
-            with open(self._file, "r") as f:
-                self._caches = DotMap(json.loads(f.read()))
+        with utilities.FileLock(self._lock_file):
+            exists = self._backend.exists()
+            self._backend.open()
+            if not exists:
+                self._migrate_legacy()
 
     def save(self):
-        with open(self._file, "w") as f:
-            f.write(json.dumps(self._caches.toDict()))
+        """
+        Writes every pending change to the backend.
+        Only the entries changed by this process are written, so concurrent runs
+        that touch different namespaces or entries keep each other's updates.
+        """
+        with self._lock:
+            changes = []
+            for namespace in self._namespaces.values():
+                change = namespace._take_changes()
+                if change is not None:
+                    changes.append(change)
+            if not changes:
+                return
+            with utilities.FileLock(self._lock_file):
+                self._backend.commit(changes)
+
+    def namespace(self, name: str) -> CacheNamespace:
+        """
+        Returns the namespace with the given name, creating it if needed
+        """
+        namespace = self._namespaces.get(name)
+        if namespace is None:
+            namespace = CacheNamespace(self, name)
+            self._namespaces[name] = namespace
+        return namespace
 
-    def __getitem__(self, key):
-        if key not in self._caches:
-            self._caches[key] = DotMap()
-        return self._caches[key]
+    def __getitem__(self, key: str) -> CacheNamespace:
+        return self.namespace(key)
 
-    def __setitem__(self, key, value):
-        self._caches[key] = value
+
+def _stat_signature(st: os.stat_result) -> Mapping[str, int]:
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "inode": st.st_ino}
 
 
 class FileCache:
     """
-    Implements a cache of file hashes relative to the root of the cache manager
+    Implements a cache of file hashes relative to the root of the cache manager.
+    Each entry stores the algorithm and the stat signature (size, mtime and inode)
+    of the file when it was hashed, so unchanged files can be validated without
+    being read again.
     """
 
-    def __init__(self, manager: CacheManager, cache: Mapping):
+    def __init__(self, manager: CacheManager, cache: MutableMapping):
         self._manager = manager
         self._cache = cache
 
     def garbage_collect(self):
         # garbage collect paths that no longer exist
-        self._cache = {
-            k: v
-            for k, v in self._cache.items()
-            if self._manager._root.joinpath(k).exists()
-        }
+        for k in [
+            k for k in self._cache if not self._manager._root.joinpath(k).exists()
+        ]:
+            del self._cache[k]
 
-    def validate(self, path: Path):
-        if not path.exists():
-            return False
-        rel = path.relative_to(self._manager._root)
-        hash = self._cache.get(str(rel))
-        if not hash:
-            return False
-        return hash == utilities.hash_file_sha256(path)
+    def _check(self, path: Path) -> Tuple[bool, Mapping[str, Any]]:
+        """
+        Validates a path without touching the cache.
+        Returns whether it is valid and the entry to store, if it needs updating.
+        """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False, None
+        entry = self._cache.get(str(path.relative_to(self._manager._root)))
+        if not entry:
+            return False, None
 
-    def put(self, path: Path):
+        # entries from older caches only stored the hash, which was always SHA-256
+        if isinstance(entry, str):
+            entry = {"hash": entry}
+        old_algorithm = entry.get("algorithm", "sha256")
+
+        # fast path: the file hasn't been touched since we last hashed it
+        signature = _stat_signature(st)
+        if not self._manager.paranoid and all(
+            entry.get(k) == v for k, v in signature.items()
+        ):
+            return True, None
+
+        # if the configured algorithm changed, compute the new hash in the same pass
+        # so the entry migrates over without forcing a rebuild
+        algorithm = self._manager.hash_algorithm
+        digests = self._manager.fingerprints.digests(
+            path, list(dict.fromkeys([old_algorithm, algorithm])), st
+        )
+        if entry["hash"] != digests[old_algorithm]:
+            return False, None
+
+        # contents are unchanged, refresh the signature so we skip hashing next time
+        return True, {"algorithm": algorithm, "hash": digests[algorithm], **signature}
+
+    def _compute(self, path: Path) -> Mapping[str, Any]:
         if not path.exists():
             raise Exception(
                 f'Tried to insert the path "{str(path)}" into the cache, which does not exist!'
             )
-        rel = path.relative_to(self._manager._root)
-        self._cache[str(rel)] = utilities.hash_file_sha256(path)
+        st = os.stat(path)
+        algorithm = self._manager.hash_algorithm
+        return {
+            "algorithm": algorithm,
+            "hash": self._manager.fingerprints.digest(path, algorithm, st),
+            **_stat_signature(st),
+        }
+
+    def _store(self, path: Path, entry: Mapping[str, Any]):
+        self._cache[str(path.relative_to(self._manager._root))] = entry
+
+    def cached_digest(self, path: Path) -> Optional[str]:
+        """
+        Returns the stored hash of a path if the file hasn't been touched since it
+        was hashed with the configured algorithm, without reading it
+        """
+        if self._manager.paranoid:
+            return None
+        try:
+            st = os.stat(path)
+            entry = self._cache.get(str(path.relative_to(self._manager._root)))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict):
+            return None
+        if entry.get("algorithm", "sha256") != self._manager.hash_algorithm:
+            return None
+        signature = _stat_signature(st)
+        if any(entry.get(k) != v for k, v in signature.items()):
+            return None
+        return entry["hash"]
+
+    def check(self, path: Path) -> bool:
+        """
+        Validates a path, leaving its entry as it is even if the signature changed
+        """
+        return self._check(path)[0]
+
+    def validate(self, path: Path) -> bool:
+        valid, entry = self._check(path)
+        if entry is not None:
+            self._store(path, entry)
+        return valid
+
+    def put(self, path: Path):
+        self._store(path, self._compute(path))
+
+    def validate_many(self, paths: Iterable[Path]) -> Mapping[Path, bool]:
+        """
+        Validates several paths at once, hashing them in parallel.
+        Returns a mapping of each path to whether it is valid.
+        """
+        paths = list(dict.fromkeys(paths))
+        result = {}
+        with ThreadPoolExecutor(_hash_workers) as executor:
+            for path, (valid, entry) in zip(paths, executor.map(self._check, paths)):
+                if entry is not None:
+                    self._store(path, entry)
+                result[path] = valid
+        return result
+
+    def put_many(self, paths: Iterable[Path]):
+        """
+        Inserts several paths at once, hashing them in parallel.
+        """
+        paths = list(dict.fromkeys(paths))
+        with ThreadPoolExecutor(_hash_workers) as executor:
+            for path, entry in zip(paths, executor.map(self._compute, paths)):
+                self._store(path, entry)
 
     def clear(self):
         self._cache.clear()
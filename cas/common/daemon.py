@@ -0,0 +1,384 @@
+import cas.common.utilities as utilities
+
+import os
+import sys
+import json
+import signal
+import socket
+import hashlib
+import logging
+import tempfile
+import threading
+import _thread
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+# the same format logging.basicConfig and multiprocessing.log_to_stderr use
+_log_format = logging.BASIC_FORMAT
+_multiprocessing_log_format = "[%(levelname)s/%(processName)s] %(message)s"
+
+
+def _socket_path(root: Path) -> Optional[Path]:
+    """
+    Returns where the daemon of a project listens.
+    Socket paths are limited to around 100 characters, so it can't live in the project.
+    """
+    if os.name != "posix" or not hasattr(socket, "AF_UNIX"):
+        return None
+
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        folder = Path(runtime)
+    else:
+        # keep the socket away from other users, who could otherwise start builds as us
+        folder = Path(tempfile.gettempdir()).joinpath(f"cas-{os.getuid()}")
+        folder.mkdir(mode=0o700, exist_ok=True)
+        st = folder.stat()
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise Exception(f"{folder} is accessible by other users")
+
+    digest = hashlib.sha256(str(root).encode()).hexdigest()[:16]
+    return folder.joinpath(f"cas-{digest}.sock")
+
+
+# log records and output are sent from several threads
+_send_lock = threading.Lock()
+
+
+def _send(conn: socket.socket, message: Any):
+    data = json.dumps(message).encode() + b"\n"
+    with _send_lock:
+        conn.sendall(data)
+
+
+class _ClientLogHandler(logging.Handler):
+    """
+    Sends log records to the client whose build is running
+    """
+
+    def __init__(self, conn: socket.socket, level: int, fmt: str):
+        super().__init__(level)
+        self._conn = conn
+        # forked workers print to the redirected stderr instead
+        self._pid = os.getpid()
+        self.setFormatter(logging.Formatter(fmt))
+
+    def emit(self, record: logging.LogRecord):
+        if os.getpid() != self._pid:
+            return
+        try:
+            _send(self._conn, {"log": self.format(record)})
+        except OSError:
+            # the client went away, which cancels the build
+            pass
+
+
+class _OutputRedirect:
+    """
+    Points stdout and stderr of the daemon at the client while its build runs,
+    so tools and worker processes print there like they would in casbuild
+    """
+
+    def __init__(self, conn: socket.socket):
+        self._conn = conn
+        self._saved = {}
+        self._threads = []
+
+    def _forward(self, fd: int, pipe: int):
+        # runs until every process that inherited the pipe closed it
+        with os.fdopen(pipe, "rb", buffering=0) as f:
+            while True:
+                data = f.read(65536)
+                if not data:
+                    return
+                try:
+                    _send(self._conn, {"out": data.decode(errors="replace"), "fd": fd})
+                except OSError:
+                    pass
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd in (1, 2):
+            read, write = os.pipe()
+            self._saved[fd] = os.dup(fd)
+            os.dup2(write, fd)
+            os.close(write)
+            thread = threading.Thread(
+                target=self._forward, args=(fd, read), daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def __exit__(self, *args):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved in self._saved.items():
+            os.dup2(saved, fd)
+            os.close(saved)
+        self._saved = {}
+
+        # send what is left before the exit code, unless a tool that outlived the
+        # build keeps the pipe open
+        for thread in self._threads:
+            thread.join(1)
+        self._threads = []
+
+
+def forward(root: Path, argv: list) -> Optional[int]:
+    """
+    Runs a build in the daemon of the project, printing its log here.
+    Returns the exit code of the build, or None if there is no daemon to run it.
+    """
+    try:
+        path = _socket_path(root)
+    except Exception:
+        return None
+    if path is None or not path.exists():
+        return None
+
+    # the daemon can't take job slots from the make running us
+    if "--jobserver-" in os.environ.get("MAKEFLAGS", ""):
+        return None
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(str(path))
+    except OSError:
+        # left behind by a daemon that didn't shut down cleanly
+        conn.close()
+        return None
+
+    with conn:
+        try:
+            _send(
+                conn,
+                {
+                    "root": str(root),
+                    "cwd": os.getcwd(),
+                    "argv": argv,
+                    "env": dict(os.environ),
+                },
+            )
+            for line in conn.makefile("rb"):
+                message = json.loads(line)
+                if "log" in message:
+                    print(message["log"], file=sys.stderr, flush=True)
+                elif "out" in message:
+                    stream = sys.stdout if message["fd"] == 1 else sys.stderr
+                    stream.write(message["out"])
+                    stream.flush()
+                elif "exit" in message:
+                    return message["exit"]
+        except KeyboardInterrupt:
+            # closing the connection cancels the build
+            return 130
+
+    print("ERROR:cas.common.daemon:lost the connection to the daemon", file=sys.stderr)
+    return 1
+
+
+class BuildDaemon:
+    """
+    Serves the builds of a project over a Unix socket, one at a time.
+    The sequencer of the last build is kept, so repeating a build doesn't load the
+    configuration, cache and drivers again. A build with other arguments or
+    configuration gets a new sequencer, which takes over the cache, file hashes and
+    directory listings the last one already loaded.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        parser,
+        load_config: Callable[[Path, Any], Any],
+    ):
+        self._root = root
+        self._parser = parser
+        self._load_config = load_config
+        self._logger = logging.getLogger(__name__)
+
+        self._sequencer = None
+        self._key = None
+
+        # the connection of the build in progress
+        self._lock = threading.Lock()
+        self._active = None
+        self._cancelled = False
+        self._stopping = False
+        # restored once a build is over
+        self._environ = dict(os.environ)
+        self._handlers = []
+
+    def serve(self) -> bool:
+        path = _socket_path(self._root)
+        if path is None:
+            self._logger.error("the daemon is only supported on POSIX systems")
+            return False
+
+        if path.exists():
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(str(path))
+                self._logger.error("a daemon is already running for this project")
+                return False
+            except OSError:
+                path.unlink()
+            finally:
+                probe.close()
+
+        # records are filtered by the handlers, so verbose clients get debug output
+        # even if the daemon itself isn't verbose
+        root_logger = logging.getLogger()
+        for handler in root_logger.handlers:
+            handler.setLevel(root_logger.level)
+        root_logger.setLevel(logging.DEBUG)
+
+        # the output of builds goes to their clients, so keep our own log on a copy
+        # of the stderr we were started with
+        console = os.fdopen(os.dup(2), "w", buffering=1)
+        for logger in (root_logger, logging.getLogger("multiprocessing")):
+            for handler in logger.handlers:
+                if isinstance(handler, logging.StreamHandler):
+                    handler.setStream(console)
+
+        # stopping the daemon interrupts a build the way Ctrl+C does, so the tools
+        # it runs are terminated and the socket is removed
+        terminate = signal.signal(signal.SIGTERM, self._terminate)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(str(path))
+            server.listen()
+            self._logger.info(
+                f"serving builds of {self._root} on {path}, press Ctrl+C to stop"
+            )
+            while True:
+                conn, _ = server.accept()
+                try:
+                    with conn:
+                        self._handle(conn)
+                except KeyboardInterrupt:
+                    # a client that went away just as its build finished
+                    if not self._client_cancelled():
+                        raise
+                    self._restore()
+        except KeyboardInterrupt:
+            self._logger.info("daemon stopped")
+        finally:
+            server.close()
+            path.unlink()
+            signal.signal(signal.SIGTERM, terminate)
+        return True
+
+    def _terminate(self, signum, frame):
+        self._stopping = True
+        raise KeyboardInterrupt
+
+    def _client_cancelled(self) -> bool:
+        return self._cancelled and not self._stopping
+
+    def _watch_client(self, conn: socket.socket):
+        # clients send nothing after the request, so this returns once they disconnect
+        try:
+            while conn.recv(4096):
+                pass
+        except OSError:
+            pass
+        with self._lock:
+            if self._active is conn:
+                self._cancelled = True
+                _thread.interrupt_main()
+
+    def _handle(self, conn: socket.socket):
+        try:
+            request = json.loads(conn.makefile("rb").readline())
+            args = self._parser.parse_args(request["argv"])
+        except (ValueError, KeyError, SystemExit):
+            self._logger.warning("ignoring a malformed request")
+            return
+
+        if Path(request["root"]) != self._root:
+            _send(conn, {"log": f"ERROR:{__name__}:the daemon builds {self._root}"})
+            _send(conn, {"exit": 1})
+            return
+
+        level = logging.DEBUG if args.verbose else logging.INFO
+        handlers = [
+            (logging.getLogger(), _ClientLogHandler(conn, level, _log_format)),
+            (
+                logging.getLogger("multiprocessing"),
+                _ClientLogHandler(conn, level, _multiprocessing_log_format),
+            ),
+        ]
+        for logger, handler in handlers:
+            logger.addHandler(handler)
+        self._handlers = handlers
+
+        self._cancelled = False
+        self._active = conn
+        threading.Thread(target=self._watch_client, args=(conn,), daemon=True).start()
+
+        # tools and the configuration see the environment casbuild was run in
+        code = 1
+        try:
+            # relative paths in the configuration are relative to where casbuild ran
+            os.chdir(request["cwd"])
+            os.environ.clear()
+            os.environ.update(request.get("env", self._environ))
+            with _OutputRedirect(conn):
+                code = 0 if self._build(args) else 1
+        except KeyboardInterrupt:
+            # a build stopped halfway may have left its sequencer in any state
+            self._sequencer = None
+            if not self._client_cancelled():
+                raise
+            self._logger.info("build cancelled by the client")
+        except Exception:
+            self._sequencer = None
+            self._logger.exception("build failed with an exception")
+        finally:
+            self._restore()
+
+        try:
+            _send(conn, {"exit": code})
+        except OSError:
+            pass
+
+    def _restore(self):
+        # a cancellation sent just before the build finished can arrive while
+        # restoring, so start over until everything has been restored. One that
+        # arrives before this is called is caught by serve, which calls it again.
+        interrupted = None
+        while True:
+            try:
+                with self._lock:
+                    self._active = None
+                os.environ.clear()
+                os.environ.update(self._environ)
+                for logger, handler in self._handlers:
+                    logger.removeHandler(handler)
+                break
+            except KeyboardInterrupt as e:
+                interrupted = e
+        if interrupted is not None and not self._client_cancelled():
+            raise interrupted
+
+    def _build(self, args) -> bool:
+        # imported here, as it is only needed by the daemon and not by clients
+        from cas.common.sequencer import Sequencer
+
+        config = self._load_config(self._root, args)
+        # the environment can change the tools and paths a build uses
+        key = (
+            utilities.hash_object_sha256(config),
+            utilities.hash_object_sha256(dict(os.environ)),
+        )
+        if self._sequencer is None or key != self._key:
+            previous = self._sequencer.env if self._sequencer is not None else None
+            self._sequencer = Sequencer(self._root, config, previous)
+            self._key = key
+        else:
+            self._logger.debug("reusing the sequencer of the last build")
+
+        return self._sequencer.run()
@@ -0,0 +1,63 @@
+import cas.common.utilities as utilities
+
+import os
+import threading
+from pathlib import Path
+from typing import Mapping, Sequence
+
+
+class FingerprintService:
+    """
+    Memoises file digests for the duration of a run.
+    Digests are keyed by the path and its stat signature, so every file is read at most
+    once per signature no matter how many caches or subsystems ask for it.
+    """
+
+    def __init__(self):
+        self._digests = {}
+        self._lock = threading.Lock()
+
+        self.computed = 0
+        self.avoided = 0
+
+    def __getstate__(self):
+        # digests are only shared within the main process
+        return {"_digests": {}, "computed": 0, "avoided": 0}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def reset_stats(self):
+        self.computed = 0
+        self.avoided = 0
+
+    def digests(
+        self, path: Path, algorithms: Sequence[str], st: os.stat_result = None
+    ) -> Mapping[str, str]:
+        """
+        Returns the requested hashlib digests of a file.
+        Missing digests are computed together in a single read of the file.
+        """
+        if st is None:
+            st = os.stat(path)
+        key = (os.fspath(path), st.st_size, st.st_mtime_ns, st.st_ino)
+
+        with self._lock:
+            known = self._digests.setdefault(key, {})
+            missing = [a for a in algorithms if a not in known]
+            self.avoided += len(algorithms) - len(missing)
+
+        if missing:
+            result = utilities.hash_file(path, missing)
+            with self._lock:
+                known.update(result)
+                self.computed += len(missing)
+
+        return {a: known[a] for a in algorithms}
+
+    def digest(self, path: Path, algorithm: str, st: os.stat_result = None) -> str:
+        """
+        Returns a single hashlib digest of a file
+        """
+        return self.digests(path, [algorithm], st)[algorithm]
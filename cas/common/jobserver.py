@@ -0,0 +1,207 @@
+import os
+import re
+import stat
+import shlex
+import logging
+import threading
+from typing import Callable, Sequence
+
+_auth_regex = re.compile(r"--jobserver-(?:auth|fds)=(\S+)")
+
+
+class Jobserver:
+    """
+    Shares job slots with GNU make through its jobserver protocol.
+    When CAS runs under a parallel make it takes slots from that make's jobserver,
+    otherwise it hosts one so the makes it starts share its slots.
+    Every process owns one implicit slot, anything beyond that needs a token.
+    """
+
+    def __init__(self, jobs: int):
+        self._logger = logging.getLogger(__name__)
+        self._reset()
+
+        if os.name != "posix":
+            return
+        if not self._connect(os.environ.get("MAKEFLAGS", "")):
+            self._host(jobs)
+
+    def _reset(self):
+        self._read_fd = None
+        self._write_fd = None
+        self._fifo = None
+        self._hosted = False
+        self._jobs = None
+
+        self._tokens = []
+        self._wanted = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._notify = None
+        self._disposed = False
+
+    def __getstate__(self):
+        return {"_logger": self._logger}
+
+    def __setstate__(self, state):
+        # workers never take tokens themselves, the scheduler does it for them
+        self.__dict__.update(state)
+        self._reset()
+
+    @property
+    def enabled(self) -> bool:
+        return self._read_fd is not None
+
+    def _connect(self, makeflags: str) -> bool:
+        # make only passes the jobserver on to commands it considers recursive
+        match = None
+        for match in _auth_regex.finditer(makeflags):
+            pass
+        if match is None:
+            return False
+
+        auth = match.group(1)
+        try:
+            if auth.startswith("fifo:"):
+                self._fifo = auth[len("fifo:") :]
+                self._read_fd = os.open(self._fifo, os.O_RDONLY | os.O_CLOEXEC)
+                self._write_fd = os.open(self._fifo, os.O_WRONLY | os.O_CLOEXEC)
+            else:
+                read_fd, write_fd = (int(fd) for fd in auth.split(","))
+                # make closes the pipe for commands it doesn't think are recursive,
+                # and the descriptors may have been reused for something else since
+                for fd in (read_fd, write_fd):
+                    if not stat.S_ISFIFO(os.fstat(fd).st_mode):
+                        raise OSError(f"descriptor {fd} is not a pipe")
+                self._read_fd = read_fd
+                self._write_fd = write_fd
+        except (OSError, ValueError):
+            self._logger.warning(
+                "jobserver from MAKEFLAGS is not available, mark the rule that runs casbuild with '+'"
+            )
+            self._read_fd = None
+            self._write_fd = None
+            return False
+
+        self._logger.debug(f"using the jobserver of the parent make ({auth})")
+        return True
+
+    def _host(self, jobs: int):
+        self._read_fd, self._write_fd = os.pipe()
+        self._hosted = True
+        self._jobs = jobs
+        # one slot is implicit, so only the rest go in the pipe
+        os.write(self._write_fd, b"+" * max(0, jobs - 1))
+        self._logger.debug(f"hosting a jobserver with {jobs} slots")
+
+    def _reader(self):
+        while not self._disposed:
+            self._wanted.wait()
+            if self._disposed:
+                return
+            try:
+                token = os.read(self._read_fd, 1)
+            except OSError:
+                return
+            if not token:
+                return
+
+            with self._lock:
+                # nobody wants it anymore, so don't sit on it
+                if not self._wanted.is_set():
+                    os.write(self._write_fd, token)
+                    continue
+                self._tokens.append(token)
+                self._wanted.clear()
+                notify = self._notify
+            if notify is not None:
+                notify()
+
+    def try_acquire(self, notify: Callable[[], None] = None) -> bool:
+        """
+        Takes a token without blocking. If none is available yet, one is requested
+        and notify is called from another thread once it arrives.
+        """
+        if not self.enabled:
+            return True
+
+        with self._lock:
+            if self._tokens:
+                self._tokens.pop()
+                return True
+            self._notify = notify
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._reader, daemon=True)
+                self._thread.start()
+            self._wanted.set()
+        return False
+
+    def release(self):
+        """
+        Gives a token taken with try_acquire back to the jobserver
+        """
+        if not self.enabled:
+            return
+        os.write(self._write_fd, b"+")
+
+    def close(self):
+        """
+        Returns any token that was fetched but never used
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            for token in self._tokens:
+                os.write(self._write_fd, token)
+            self._tokens = []
+            self._wanted.clear()
+
+    def serves(self, jobs: int) -> bool:
+        """
+        Whether a build running the given number of jobs can use this jobserver
+        """
+        return not self._hosted or self._jobs == jobs
+
+    def dispose(self):
+        """
+        Shuts the jobserver down for good, closing the pipe it hosts
+        """
+        self.close()
+        if not self._hosted:
+            return
+
+        with self._lock:
+            self._disposed = True
+            self._wanted.set()
+        if self._thread is not None:
+            # wakes the reader if it is waiting for a token, the pipe is ours alone
+            os.write(self._write_fd, b"+")
+            self._thread.join()
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+        self._read_fd = None
+        self._write_fd = None
+
+    def makeflags(self) -> str:
+        """
+        Returns MAKEFLAGS for a make started by CAS, so it joins the jobserver
+        """
+        flags = os.environ.get("MAKEFLAGS", "")
+        if not self._hosted:
+            return flags
+
+        flags = " ".join(
+            flag
+            for flag in shlex.split(flags)
+            if not _auth_regex.match(flag) and not flag.startswith("-j")
+        )
+        auth = f"{self._read_fd},{self._write_fd}"
+        return f"{flags} -j{self._jobs} --jobserver-fds={auth} --jobserver-auth={auth}".strip()
+
+    def fds(self) -> Sequence[int]:
+        """
+        Returns the file descriptors a make started by CAS needs to inherit
+        """
+        if not self.enabled or self._fifo is not None:
+            return ()
+        return (self._read_fd, self._write_fd)
@@ -2,12 +2,22 @@ import cas.common.utilities as utilities
 from cas.common.steamtools import SteamInstance
 from cas.common.config import ConfigurationUtilities, LazyDynamicBase
 from cas.common.cache import CacheManager
+from cas.common.fingerprint import FingerprintService
+from cas.common.jobserver import Jobserver
+from cas.common.scanner import FileScanner
 
 from pathlib import Path
-from typing import Any, List, Union
+from typing import Any, List, Optional, Sequence, Set, Tuple, Union
 import os
 import logging
 import subprocess
+import threading
+
+_logger = logging.getLogger(__name__)
+
+# tools started through run_tool that haven't exited yet
+_running_tools = set()
+_running_tools_lock = threading.Lock()
 
 
 class BuildEnvironment:
@@ -15,11 +25,46 @@ class BuildEnvironment:
     Contains attributes about the current build environment
     """
 
-    def __init__(self, path: str, config: dict):
+    def __init__(self, path: str, config: dict, previous: "BuildEnvironment" = None):
+        """
+        previous is an environment of an earlier build of the same project in this
+        process, whose loaded cache, file hashes and directory listings are taken over
+        if they were created with the same settings
+        """
         self.config = ConfigurationUtilities.parse_root_config(path, config)
 
-        self.cache = CacheManager(path)
-        self.cache.load()
+        # set up before anything else opens files, while inherited descriptors are intact
+        threads = self.config.args.threads
+        if previous is not None and previous.jobserver.serves(threads):
+            self.jobserver = previous.jobserver
+        else:
+            if previous is not None:
+                previous.jobserver.dispose()
+            self.jobserver = Jobserver(threads)
+
+        paranoid = self.config.args.paranoid
+        backend = self.config.options.cache_backend
+        algorithm = self.config.options.hash_algorithm
+        if previous is not None and previous._cache_settings == (
+            paranoid,
+            backend,
+            algorithm,
+        ):
+            self.fingerprints = previous.fingerprints
+            self.cache = previous.cache
+            self.scanner = previous.scanner
+        else:
+            self.fingerprints = FingerprintService()
+            self.cache = CacheManager(
+                path, paranoid, backend, self.fingerprints, algorithm
+            )
+            self.cache.load()
+
+            # paranoid builds don't trust directory timestamps from earlier runs either
+            self.scanner = FileScanner(
+                None if paranoid else self.cache.namespace("directories")
+            )
+        self._cache_settings = (paranoid, backend, algorithm)
 
         self.build_type = self.config.args.build_type
         self.build_categories = None
@@ -104,18 +149,26 @@ class BuildEnvironment:
             raise NotImplementedError()
         return self.bindir.joinpath(lib).resolve()
 
-    def run_subprocess(self, *args, **kwargs):
+    def _subprocess_defaults(self) -> dict:
         predef = {}
         if not self.verbose:
             predef["stdout"] = subprocess.DEVNULL
             predef["stderr"] = subprocess.DEVNULL
-        return subprocess.run(*args, **dict(predef, **kwargs))
+        return predef
+
+    def run_subprocess(self, *args, **kwargs):
+        return subprocess.run(*args, **dict(self._subprocess_defaults(), **kwargs))
 
     def run_tool(
-        self, args: List[str], source: bool = False, cwd: Union[str, Path] = None
+        self,
+        args: List[str],
+        source: bool = False,
+        cwd: Union[str, Path] = None,
+        timeout: float = None,
     ) -> int:
         """
-        High-level interface to run an executable with extra parameters
+        High-level interface to run an executable with extra parameters.
+        If the tool runs for longer than timeout seconds it is killed and -1 is returned.
         """
         predef = {}
         predef["env"] = os.environ
@@ -127,10 +180,32 @@ class BuildEnvironment:
             predef["cwd"] = cwd
 
         try:
-            result = self.run_subprocess(args, **predef)
+            proc = subprocess.Popen(args, **dict(self._subprocess_defaults(), **predef))
         except Exception as e:
             raise Exception(f"failed to execute tool with parameters: {args}") from e
-        return result.returncode
+
+        # track the process so a failing build can stop tools started from other threads
+        with _running_tools_lock:
+            _running_tools.add(proc)
+        try:
+            return proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            _logger.error(f"tool timed out after {timeout}s: {args}")
+            return -1
+        finally:
+            with _running_tools_lock:
+                _running_tools.discard(proc)
+
+    @staticmethod
+    def terminate_tools():
+        """
+        Kills every tool started through run_tool in this process that is still running
+        """
+        with _running_tools_lock:
+            for proc in _running_tools:
+                proc.kill()
 
 
 class BuildResult:
@@ -153,7 +228,7 @@ class BuildSubsystem:
 
         self.env = env
         self.config = config
-        self._cache = env.cache["subsystems"][mod]
+        self._cache = env.cache.namespace(f"subsystems/{mod}")
         self._logger = logging.getLogger(mod)
 
     def _get_config_raw(self) -> Any:
@@ -194,3 +269,18 @@ class BuildSubsystem:
         Removes all the output files generated by this subsystem.
         """
         raise NotImplementedError()
+
+    def watched_folders(self) -> Sequence[Tuple[Path, bool]]:
+        """
+        Returns the folders watch mode should watch for this subsystem,
+        each with whether its subfolders are watched as well.
+        Subsystems without any aren't rebuilt by watch mode.
+        """
+        return []
+
+    def rebuild(self, changed: Optional[Set[Path]]) -> bool:
+        """
+        Rebuilds whatever depends on the files that changed in watch mode.
+        changed is None when changes may have been missed.
+        """
+        raise NotImplementedError()
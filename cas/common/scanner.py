@@ -0,0 +1,270 @@
+import cas.common.utilities as utilities
+
+import os
+import re
+import time
+import threading
+from pathlib import Path
+from typing import Callable, Iterator, List, Mapping, MutableMapping, Sequence, Tuple
+
+# filesystems with the coarsest timestamps (FAT) store them in 2 second steps
+_settle_ns = 2_000_000_000
+
+
+def _translate_segment(segment: str) -> str:
+    """
+    Translates a single path segment of a glob pattern into a regular expression
+    """
+    i = 0
+    result = ""
+    while i < len(segment):
+        c = segment[i]
+        i += 1
+        if c == "*":
+            result += "[^/]*"
+        elif c == "?":
+            result += "[^/]"
+        elif c == "[":
+            end = segment.find("]", i + 1 if segment[i : i + 1] in ("!", "]") else i)
+            if end == -1:
+                result += re.escape(c)
+                continue
+            chars = segment[i:end].replace("\\", "\\\\")
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            elif chars.startswith("^"):
+                chars = "\\" + chars
+            result += f"[{chars}]"
+            i = end + 1
+        else:
+            result += re.escape(c)
+    return result
+
+
+def translate_glob(pattern: str, recursive: bool = True) -> str:
+    """
+    Translates a pathlib style glob pattern into a regular expression matching
+    relative paths separated by forward slashes.
+    Recursive patterns match at any depth, like Path.rglob.
+    """
+    segments = [s for s in pattern.replace("\\", "/").split("/") if s not in ("", ".")]
+    result = "(?:[^/]+/)*" if recursive else ""
+    for i, segment in enumerate(segments):
+        if segment == "**":
+            result += "(?:[^/]+/)*"
+            continue
+        result += _translate_segment(segment)
+        if i < len(segments) - 1:
+            result += "/"
+    return result
+
+
+def compile_globs(patterns: Sequence[str], recursive: bool = True) -> re.Pattern:
+    """
+    Compiles several glob patterns into a single matcher
+    """
+    flags = re.IGNORECASE if utilities.is_platform_windows() else 0
+    regex = "|".join(f"(?:{translate_glob(p, recursive)})" for p in patterns)
+    return re.compile(f"(?:{regex})", flags)
+
+
+class GlobFilter:
+    """
+    Matches relative paths against an ordered list of glob patterns, where patterns
+    starting with ! exclude and the last pattern matching a path decides, like gitignore.
+    Directories whose whole contents are excluded by a pattern that no include
+    comes after can be skipped without being listed.
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        flags = re.IGNORECASE if utilities.is_platform_windows() else 0
+
+        self._patterns = []
+        covering = []
+        last_include = -1
+        for i, pattern in enumerate(patterns):
+            exclusion = pattern.startswith("!")
+            if exclusion:
+                pattern = pattern[1:]
+            else:
+                last_include = i
+            self._patterns.append(
+                (exclusion, re.compile(translate_glob(pattern), flags))
+            )
+
+            # an exclusion of everything below some folder covers that folder
+            if exclusion:
+                parts = pattern.replace("\\", "/").rstrip("/").split("/")
+                if parts[-2:] == ["**", "*"] or parts in (["*"], ["**", "*"]):
+                    covering.append((i, "/".join(parts[:-2] if len(parts) > 1 else [])))
+
+        # only exclusions after the last include are final
+        self._pruning = [
+            re.compile(translate_glob(prefix), flags) if prefix else None
+            for i, prefix in covering
+            if i > last_include
+        ]
+        self._any = compile_globs([p.lstrip("!") for p in patterns])
+
+    def prunes(self, reldir: str) -> bool:
+        """
+        Whether nothing below a directory can be included
+        """
+        return any(regex is None or regex.fullmatch(reldir) for regex in self._pruning)
+
+    def match(self, relpath: str) -> int:
+        """
+        Returns the index of the pattern that added a path to the results,
+        or -1 if the path is excluded or not matched at all
+        """
+        if not self._any.fullmatch(relpath):
+            return -1
+
+        added = -1
+        for i, (exclusion, regex) in enumerate(self._patterns):
+            if not regex.fullmatch(relpath):
+                continue
+            if exclusion:
+                added = -1
+            elif added == -1:
+                added = i
+        return added
+
+
+class FileScanner:
+    """
+    Lists directories for the whole run, so trees that several subsystems and
+    asset contexts look at are only read from disk once.
+    A listing is reused for as long as the modification time of its directory
+    doesn't change. Given an index, listings are also kept between runs, so
+    directories that haven't changed since the last build aren't listed at all.
+    """
+
+    def __init__(self, index: MutableMapping = None):
+        self._lock = threading.Lock()
+        self._listings: Mapping[str, Tuple[int, List[str], List[str]]] = {}
+        self._index = index
+        self._removed = set()
+
+        self.listed = 0
+        self.reused = 0
+        self.indexed = 0
+
+    def __getstate__(self):
+        # workers don't scan, so there is no point in sending the listings over
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def _list(self, path: str) -> Tuple[List[str], List[str]]:
+        """
+        Returns the names of the files and subdirectories in a directory
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return [], []
+
+        cached = self._listings.get(path)
+        if cached is not None and cached[0] == mtime:
+            with self._lock:
+                self.reused += 1
+            return cached[1], cached[2]
+
+        stored = self._index.get(path) if self._index is not None else None
+        if stored is not None and stored[0] == mtime:
+            with self._lock:
+                self._listings[path] = (mtime, stored[1], stored[2])
+                self.indexed += 1
+            return stored[1], stored[2]
+
+        files = []
+        dirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        # like Path.rglob, don't descend into linked directories
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.name)
+                        elif entry.is_file():
+                            files.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return [], []
+
+        with self._lock:
+            self._listings[path] = (mtime, files, dirs)
+            self.listed += 1
+            if stored is not None:
+                self._removed.update(
+                    os.path.join(path, name) for name in set(stored[2]) - set(dirs)
+                )
+
+        # a directory changed again within the resolution of its timestamp would
+        # keep the same mtime, so only listings that have settled are remembered
+        if self._index is not None and time.time_ns() - mtime > _settle_ns:
+            self._index[path] = [mtime, files, dirs]
+        return files, dirs
+
+    def reset_stats(self):
+        self.listed = 0
+        self.reused = 0
+        self.indexed = 0
+
+    def garbage_collect(self):
+        """
+        Drops the index entries of directories that were found to be removed
+        """
+        if self._index is None or not self._removed:
+            return
+        prefixes = tuple(path + os.sep for path in self._removed)
+        for k in [
+            k for k in self._index if k in self._removed or k.startswith(prefixes)
+        ]:
+            del self._index[k]
+        self._removed = set()
+
+    def walk(
+        self, root: Path, prune: Callable[[str], bool] = None
+    ) -> Iterator[Tuple[str, str]]:
+        """
+        Yields the relative and full path of every file below root.
+        Directories for which prune returns True are not descended into.
+        """
+        stack = [("", str(root))]
+        while stack:
+            relpath, path = stack.pop()
+            files, dirs = self._list(path)
+            for name in files:
+                yield relpath + name, os.path.join(path, name)
+            for name in reversed(dirs):
+                reldir = relpath + name
+                if prune is not None and prune(reldir):
+                    continue
+                stack.append((reldir + "/", os.path.join(path, name)))
+
+    def glob(self, root: Path, patterns: Sequence[str]) -> Iterator[Path]:
+        """
+        Yields the files below root matching any of the patterns, like Path.rglob.
+        Files are yielded as the walk finds them, so callers can start on them early.
+        """
+        matcher = compile_globs(patterns)
+        for relpath, path in self.walk(root):
+            if matcher.fullmatch(relpath):
+                yield Path(path)
+
+    def glob_filtered(self, root: Path, patterns: Sequence[str]) -> List[Path]:
+        """
+        Finds the files below root selected by a list of include and !exclude patterns.
+        Files are ordered by the pattern that added them, then in the order they were found.
+        """
+        matcher = GlobFilter(patterns)
+        buckets = [[] for _ in patterns]
+        for relpath, path in self.walk(root, matcher.prunes):
+            added = matcher.match(relpath)
+            if added != -1:
+                buckets[added].append(Path(path))
+        return [path for bucket in buckets for path in bucket]
@@ -1,5 +1,6 @@
 from cas.common.models import BuildEnvironment, BuildSubsystem
 from cas.common.config import DataResolverScope
+from cas.common.watcher import create_watcher
 
 from pathlib import Path
 from typing import Mapping
@@ -13,8 +14,8 @@ class Sequencer:
     Class that executes a number of discrete programs (subsystems) in order.
     """
 
-    def __init__(self, path: Path, config: dict):
-        self.env = BuildEnvironment(path, config)
+    def __init__(self, path: Path, config: dict, previous: BuildEnvironment = None):
+        self.env = BuildEnvironment(path, config, previous)
 
         self._args = self.env.config.args
         self._subsystems: Mapping[str, BuildSubsystem] = {}
@@ -78,6 +79,10 @@ class Sequencer:
         return True
 
     def run(self) -> bool:
+        # the environment outlives a single run in watch mode and the daemon
+        self.env.fingerprints.reset_stats()
+        self.env.scanner.reset_stats()
+
         # build whitelist/blacklist
         whitelist = self._args.include_subsystems
         blacklist = self._args.exclude_subsystems
@@ -99,4 +104,54 @@ class Sequencer:
                 continue
             if not self._run_subsystem(scope, sub):
                 return False
+
+        fingerprints = self.env.fingerprints
+        self._logger.info(
+            f"computed {fingerprints.computed} file hash(es), avoided {fingerprints.avoided} redundant hash(es)"
+        )
+        scanner = self.env.scanner
+        lookups = scanner.listed + scanner.indexed
+        rate = (scanner.indexed / lookups * 100) if lookups else 0
+        self._logger.debug(
+            f"listed {scanner.listed} directories, reused {scanner.reused} listing(s), "
+            f"{scanner.indexed} unchanged since the last run ({rate:.0f}% directory index hit rate)"
+        )
+
+        scanner.garbage_collect()
+        self.env.cache.save()
+        return True
+
+    def watch(self) -> bool:
+        """
+        Rebuilds the subsystems that ran whenever files they depend on change,
+        until interrupted. Everything loaded by the first build stays in memory.
+        """
+        subsystems = {
+            name: sys for name, sys in self._subsystems.items() if sys.watched_folders()
+        }
+        if not subsystems:
+            self._logger.error("none of the subsystems that ran can be watched")
+            return False
+
+        watcher = create_watcher(
+            [f for sys in subsystems.values() for f in sys.watched_folders()]
+        )
+        self._logger.info(
+            f"watching {', '.join(subsystems.keys())} for changes, press Ctrl+C to stop"
+        )
+        try:
+            while True:
+                changed = watcher.wait()
+                for name, sys in subsystems.items():
+                    if not sys.rebuild(changed):
+                        self._logger.error(
+                            f"subsystem {name} failed, waiting for changes"
+                        )
+                    # rebuilds may have found dependencies in other folders
+                    for folder, recursive in sys.watched_folders():
+                        watcher.add(folder, recursive)
+        except KeyboardInterrupt:
+            self._logger.info("stopped watching")
+        finally:
+            watcher.close()
         return True
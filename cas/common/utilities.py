@@ -2,6 +2,7 @@ import os
 import sys
 import json
 import hashlib
+import mmap
 import struct
 import logging
 
@@ -9,7 +10,12 @@ import tqdm
 
 from pathlib import Path
 from dotmap import DotMap
-from typing import List, Mapping, Any
+from typing import List, Mapping, Optional, Sequence, Any
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
 
 
 class TqdmLoggingHandler(logging.Handler):
@@ -27,6 +33,40 @@ class TqdmLoggingHandler(logging.Handler):
             self.handleError(record)
 
 
+class FileLock:
+    """
+    Exclusive advisory lock on a file, shared between processes
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self._path, "a+b")
+        if is_platform_windows():
+            self._file.seek(0)
+            while True:
+                try:
+                    # LK_LOCK gives up after 10 seconds, so keep retrying
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if is_platform_windows():
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
 def relative_paths(root: Path, paths: list) -> List[str]:
     """
     Normalises paths from incoming configuration and ensures
@@ -70,29 +110,18 @@ def rglob_invert(patterns: List[str]) -> List[str]:
     return result
 
 
-def rglob_multi(root: Path, patterns: List[str]) -> List[Path]:
+def rglob_multi(root: Path, patterns: List[str], scanner=None) -> List[Path]:
     """
     Advanced recursive glob of a path collapsing multiple include/exclude patterns.
+    Patterns starting with ! are exclusions, and the last pattern matching a file decides
+    whether it is included. Excluded folders are skipped rather than walked.
     """
-    files = []
-    for pattern in patterns:
-        # patterns starting with ! are treated as exclusions
-        exclusion = pattern.startswith("!")
-        if exclusion:
-            pattern = pattern[1:]
-
-        for path in root.rglob(pattern):
-            if not path.is_file():
-                continue
-            if exclusion:
-                if path in files:
-                    files.remove(path)
-            else:
-                if path in files:
-                    continue
-                files.append(path)
+    # imported here as the scanner depends on this module
+    from cas.common.scanner import FileScanner
 
-    return files
+    if scanner is None:
+        scanner = FileScanner()
+    return scanner.glob_filtered(root, patterns)
 
 
 def paths_to_relative(root, paths) -> List:
@@ -102,15 +131,32 @@ def paths_to_relative(root, paths) -> List:
     return out
 
 
-def hash_file_sha256(path: Path) -> str:
-    hash = hashlib.sha256()
+# files at least this large are hashed through a memory map instead of buffered reads
+MMAP_HASH_THRESHOLD = 4 * 1024 * 1024
+
+
+def hash_file(path: Path, algorithms: Sequence[str]) -> Mapping[str, str]:
+    """
+    Computes one or more hashlib digests of a file in a single read pass
+    """
+    hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
     with open(path, "rb") as f:
-        while True:
-            data = f.read(65536)
-            if not data:
-                break
-            hash.update(data)
-    return hash.hexdigest()
+        if os.fstat(f.fileno()).st_size >= MMAP_HASH_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for hash in hashes.values():
+                    hash.update(data)
+        else:
+            while True:
+                data = f.read(65536)
+                if not data:
+                    break
+                for hash in hashes.values():
+                    hash.update(data)
+    return {algorithm: hash.hexdigest() for algorithm, hash in hashes.items()}
+
+
+def hash_file_sha256(path: Path) -> str:
+    return hash_file(path, ["sha256"])["sha256"]
 
 
 def hash_object_sha256(obj: Any) -> str:
@@ -177,6 +223,23 @@ def is_platform_osx() -> bool:
     return sys.platform.startswith("osx")
 
 
+def get_available_memory() -> Optional[int]:
+    """
+    Returns the amount of memory available for new processes in megabytes,
+    or None if it can't be determined on this platform
+    """
+    if not is_platform_linux():
+        return None
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
 def get_dotpath_value(key: str, mapping: Mapping) -> Any:
     keys = key.split(".")
     current = mapping
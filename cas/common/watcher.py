@@ -0,0 +1,272 @@
+import cas.common.utilities as utilities
+
+import os
+import time
+import errno
+import struct
+import select
+import logging
+import ctypes
+import ctypes.util
+from pathlib import Path
+from typing import Mapping, Optional, Sequence, Set, Tuple
+
+# how long the files have to stay quiet before a burst of changes is handed out
+_settle_seconds = 0.3
+# how often the polling watcher looks at the files
+_poll_seconds = 1.0
+
+# from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_DONT_FOLLOW = 0x02000000
+_IN_ISDIR = 0x40000000
+
+_watch_mask = (
+    _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+    | _IN_ONLYDIR
+    | _IN_DONT_FOLLOW
+)
+_event_header = struct.Struct("iIII")
+
+
+class FileWatcher:
+    """
+    Reports files that were created, modified or removed below a set of folders.
+    Changes arriving in quick succession, like an editor saving several files
+    or an exporter writing a model, are handed out together.
+    """
+
+    def __init__(self):
+        self._logger = logging.getLogger(__name__)
+        self._folders: Mapping[Path, bool] = {}
+
+    def add(self, folder: Path, recursive: bool = True):
+        """
+        Starts watching a folder, and all of its subfolders if recursive
+        """
+        folder = Path(folder).resolve()
+        for watched, watched_recursive in self._folders.items():
+            if watched == folder and (watched_recursive or not recursive):
+                return
+            if watched_recursive and watched in folder.parents:
+                return
+        self._folders[folder] = recursive
+        self._add(folder, recursive)
+
+    def _add(self, folder: Path, recursive: bool):
+        raise NotImplementedError()
+
+    def _poll(self, timeout: Optional[float]) -> Optional[Set[Path]]:
+        """
+        Waits up to timeout seconds for changes and returns the paths that changed.
+        Returns None if changes were lost.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def wait(self) -> Optional[Set[Path]]:
+        """
+        Blocks until files change and returns the paths that changed, once no
+        further changes arrived for a moment.
+        Returns None if changes may have been missed, so everything needs checking.
+        """
+        changed = set()
+        while True:
+            events = self._poll(_settle_seconds if changed else None)
+            if events is None:
+                self._logger.warning("too many changes at once, checking everything")
+                # keep draining until things are quiet, the result is the same
+                while self._poll(_settle_seconds) != set():
+                    pass
+                return None
+            if not events and changed:
+                return changed
+            changed |= events
+
+
+class InotifyWatcher(FileWatcher):
+    """
+    Watches folders with the Linux inotify API
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._add_watch.restype = ctypes.c_int
+
+        self._fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self._fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, f"inotify_init1: {os.strerror(e)}")
+
+        # watch descriptors to the folder they watch and whether it is recursive
+        self._watches: Mapping[int, Tuple[Path, bool]] = {}
+
+    def _add(self, folder: Path, recursive: bool):
+        self._watch(folder, recursive)
+
+    def _watch(self, folder: Path, recursive: bool) -> Set[Path]:
+        """
+        Watches a folder and returns the files already in it
+        """
+        wd = self._add_watch(self._fd, os.fsencode(folder), _watch_mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR):
+                return set()
+            raise OSError(e, f"inotify_add_watch {folder}: {os.strerror(e)}")
+        self._watches[wd] = (folder, recursive)
+
+        files = set()
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if recursive and entry.is_dir(follow_symlinks=False):
+                        files |= self._watch(Path(entry.path), True)
+                    elif not entry.is_dir():
+                        files.add(Path(entry.path))
+        except OSError:
+            pass
+        return files
+
+    def _poll(self, timeout: Optional[float]) -> Optional[Set[Path]]:
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+
+        changed = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _event_header.unpack_from(data, offset)
+                offset += _event_header.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+
+                if mask & _IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                watch = self._watches.get(wd)
+                if watch is None:
+                    continue
+                if mask & _IN_IGNORED:
+                    del self._watches[wd]
+                    continue
+                if not name:
+                    continue
+
+                folder, recursive = watch
+                path = folder.joinpath(os.fsdecode(name))
+                if mask & _IN_ISDIR:
+                    # files can land in a new folder before it is watched, so report
+                    # everything found while adding the watch
+                    if recursive and mask & (_IN_CREATE | _IN_MOVED_TO):
+                        try:
+                            changed |= self._watch(path, True)
+                        except OSError as e:
+                            self._logger.warning(f"unable to watch {path}: {e}")
+                    continue
+                changed.add(path)
+
+        return None if overflow else changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher(FileWatcher):
+    """
+    Watches folders by comparing the modification times and sizes of their files
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._snapshot: Mapping[Path, Tuple[int, int]] = {}
+
+    def _scan(self, folder: Path, recursive: bool, snapshot: dict):
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                self._scan(Path(entry.path), True, snapshot)
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    snapshot[Path(entry.path)] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            pass
+
+    def _take_snapshot(self) -> Mapping[Path, Tuple[int, int]]:
+        snapshot = {}
+        for folder, recursive in self._folders.items():
+            self._scan(folder, recursive, snapshot)
+        return snapshot
+
+    def _add(self, folder: Path, recursive: bool):
+        self._scan(folder, recursive, self._snapshot)
+
+    def _poll(self, timeout: Optional[float]) -> Optional[Set[Path]]:
+        time.sleep(_poll_seconds if timeout is None else max(timeout, _poll_seconds))
+
+        snapshot = self._take_snapshot()
+        changed = {
+            path
+            for path in snapshot.keys() | self._snapshot.keys()
+            if snapshot.get(path) != self._snapshot.get(path)
+        }
+        self._snapshot = snapshot
+        return changed
+
+
+def create_watcher(folders: Sequence[Tuple[Path, bool]]) -> FileWatcher:
+    """
+    Creates the best watcher available on this platform for some folders,
+    given as pairs of the folder and whether to watch it recursively
+    """
+    if utilities.is_platform_linux():
+        watcher = None
+        try:
+            watcher = InotifyWatcher()
+            for folder, recursive in folders:
+                watcher.add(folder, recursive)
+            return watcher
+        except OSError as e:
+            # usually the limit of watches per user being reached
+            logging.getLogger(__name__).warning(
+                f"unable to use inotify ({e}), polling for changes instead"
+            )
+            if watcher is not None:
+                watcher.close()
+
+    watcher = PollingWatcher()
+    for folder, recursive in folders:
+        watcher.add(folder, recursive)
+    return watcher
@@ -1,7 +1,11 @@
 import cas
+import cas.common.utilities as utilities
 from cas.common.config import DefaultValidatingDraft7Validator
 from cas.common.models import BuildEnvironment, BuildResult, BuildSubsystem
 from cas.common.cache import FileCache
+from cas.common.scanner import compile_globs
+from cas.common.assets.artifacts import ArtifactCache
+from cas.common.assets.dependencies import DependencyTracker, HeldAsset
 from cas.common.assets.models import (
     Asset,
     AssetBuildContext,
@@ -9,59 +13,599 @@ from cas.common.assets.models import (
     SerialDriver,
     BatchedDriver,
 )
+from cas.common.assets.scheduler import (
+    AssetJob,
+    AssetScheduler,
+    SERIAL,
+    THREAD,
+    PROCESS,
+)
 
 import os
 import json
+import math
+import time
 import logging
-import pathlib
 import importlib
+import threading
 import multiprocessing
 
-from multiprocessing.synchronize import Lock
-from typing import Mapping, Sequence, Callable, Any
+from dotmap import DotMap
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterator, Mapping, Optional, Sequence, Set, Tuple, Any
 from pathlib import Path
 
 _schema_path = Path(cas.__file__).parent.absolute().joinpath("schemas")
 
-# set up our process shared logger
-lock: Lock = None
-logger: logging.Logger = None
+# assumed compile rate of contexts that have no recorded durations yet
+_FALLBACK_SECONDS_PER_MB = 1.0
+
+# precompiling and validating is mostly file IO, so use more threads than cores
+_prebuild_workers = min(32, multiprocessing.cpu_count() + 4)
+
+# settings that change how assets are built and cached, but not what they compile to,
+# so they are left out of the configuration hash that forces rebuilds
+_operational_keys = (
+    "checkpoint_assets",
+    "checkpoint_seconds",
+    "artifact_cache",
+    "straggler_factor",
+    "memory_budget",
+)
+# the same for each asset entry and its driver options
+_operational_asset_keys = ("timeout",)
+_operational_driver_options = ("max_concurrency", "memory")
+
+
+def _entry_key(key: Tuple[int, str]) -> str:
+    # a file can be an asset of several contexts, so cache entries are per context
+    return f"{key[0]}:{key[1]}"
 
 
-def _async_mod_init(_lock: Lock):
-    global lock, logger
-    lock = _lock
-    logger = multiprocessing.get_logger()
+class _DurationEstimator:
+    """
+    Estimates how long the assets of a context take to compile.
+    Assets without a recorded duration are estimated from the size of their inputs,
+    at the rate the other assets of the context compiled.
+    """
 
+    def __init__(self, subsystem: "AssetSubsystem", index: int):
+        self._durations = subsystem._durations
+        self._index = index
 
-def _run_async_serial(
-    context: AssetBuildContext, driver: SerialDriver, asset: Asset
-) -> bool:
-    relpath = os.path.relpath(asset.path, driver.env.root)
+        self._lock = threading.Lock()
+        self._known_duration = 0.0
+        self._known_size = 0
 
-    context.logger = logger
-    if not context.logger:
-        context.logger = logging.getLogger(driver.__class__.__module__)
+    def observe(self, asset: Asset, inputs: Sequence[Path]) -> Tuple[Any, int]:
+        """
+        Looks up the recorded duration and input size of an asset.
+        Returns both, the duration being None if it isn't known.
+        """
+        key = _entry_key((self._index, asset.get_id()))
+        duration = self._durations.get(key)
+        if duration is None:
+            # older caches recorded durations by asset id alone
+            duration = self._durations.get(asset.get_id())
+            if duration is not None:
+                self._durations[key] = duration
+        size = sum(os.stat(f).st_size for f in inputs)
+        if duration is not None:
+            with self._lock:
+                self._known_duration += duration
+                self._known_size += size
+        return duration, size
+
+    def estimate(self, duration: Any, size: int) -> float:
+        if duration is not None:
+            return duration
+        with self._lock:
+            if self._known_size > 0:
+                rate = self._known_duration / self._known_size
+            else:
+                rate = _FALLBACK_SECONDS_PER_MB / (1024 * 1024)
+        return size * rate
 
-    with lock:
-        context.logger.info(f"Compiling {str(relpath)}")
-    success = driver.compile(context, asset)
 
-    if not success:
-        with lock:
-            context.logger.error(f"  Failed compile {str(relpath)}")
-    return success
+class _BuildCheckpoint:
+    """
+    Records the hashes of assets as soon as their jobs succeed, and periodically
+    saves the cache so an interrupted build resumes where it stopped.
+    Completions arrive on the scheduler's dispatch thread, so anything touching
+    the cache, which is locked while it is being saved, happens on a pool of its own.
+    """
 
+    def __init__(
+        self,
+        subsystem: "AssetSubsystem",
+        hash_inputs: Mapping[Tuple[int, str], Sequence[Path]],
+        hash_outputs: Mapping[Tuple[int, str], Sequence[Path]],
+        artifact_keys: Mapping[Tuple[int, str], str],
+        depends: Mapping[Tuple[int, str], Sequence[Path]],
+    ):
+        self._subsystem = subsystem
+        self._hash_inputs = hash_inputs
+        self._hash_outputs = hash_outputs
+        self._artifact_keys = artifact_keys
+        self._depends = depends
 
-def _run_async_batched(
-    context: AssetBuildContext, driver: BatchedDriver, assets: Sequence[Asset]
-) -> bool:
-    context.logger = logger
-    with lock:
+        config = subsystem.config
+        self._flush_assets = config.checkpoint_assets
+        self._flush_seconds = config.checkpoint_seconds
+
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+        self._executor = ThreadPoolExecutor(_prebuild_workers)
+        self._error = None
+
+    def complete(self, job: AssetJob, success: bool, elapsed: float):
+        if not success:
+            return
+
+        subsystem = self._subsystem
+        assets = job.assets
         for asset in assets:
-            relpath = os.path.relpath(asset.path, driver.env.root)
-            context.logger.info(f"Compiling {str(relpath)}")
-    return driver.compile_all(context, assets)
+            self._submit(
+                self._record, (job.index, asset.get_id()), elapsed / len(assets)
+            )
+
+        self._pending += len(assets)
+        if (
+            self._pending >= self._flush_assets
+            or time.monotonic() - self._last_flush >= self._flush_seconds
+        ):
+            self._submit(subsystem.env.cache.save)
+            self._pending = 0
+            self._last_flush = time.monotonic()
+
+    def _submit(self, fn: Callable, *args):
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._done)
+
+    def _done(self, future: Future):
+        if self._error is None and future.exception() is not None:
+            self._error = future.exception()
+
+    def _record(self, key: Tuple[int, str], elapsed: float):
+        subsystem = self._subsystem
+        subsystem._durations[_entry_key(key)] = elapsed
+        inputs = self._hash_inputs[key]
+        outputs = self._hash_outputs[key]
+        for f in inputs + outputs:
+            subsystem._file_cache.put(f)
+        if key in self._depends:
+            subsystem._record_depends(key, self._depends[key])
+        if subsystem._artifacts is None:
+            return
+
+        artifact = self._artifact_keys.get(key)
+        if artifact is None:
+            # compiled from outputs of other assets that were compiled in
+            # this build, so its key is only known now
+            context = subsystem._contexts[key[0]]
+            artifact = subsystem._artifact_key(
+                context, subsystem._artifact_options(context), inputs, outputs
+            )
+        if artifact is not None:
+            subsystem._artifacts.store(artifact, outputs)
+
+    def close(self):
+        """
+        Waits for the assets completed so far to be recorded, then saves the cache.
+        Exceptions raised while recording are raised again here.
+        """
+        self._executor.shutdown()
+        self._subsystem.env.cache.save()
+        if self._error is not None:
+            raise self._error
+
+
+class _Prebuild:
+    """
+    Discovers, precompiles and validates assets on worker threads.
+    Assets that need compiling are handed to submit as soon as they are known,
+    so compiles start while the rest of the project is still being scanned.
+    Assets compiled from outputs of other assets are held back until the assets
+    producing those files have been found up to date or submitted, then submitted
+    along with the jobs they have to wait for.
+    If assets is given, only those assets of each context are looked at.
+    Dry runs only count what would be compiled, without restoring artifacts or
+    updating the file cache.
+    """
+
+    def __init__(
+        self,
+        subsystem: "AssetSubsystem",
+        contexts: Sequence[AssetBuildContext],
+        submit: Callable[[AssetJob], None],
+        finished: Callable[[], None] = None,
+        failed: Callable[[], None] = None,
+        assets: Mapping[int, Sequence[Path]] = None,
+    ):
+        self._subsystem = subsystem
+        self._contexts = contexts
+        self._assets = assets
+        self._submit = submit
+        self._finished = finished
+        self._failed = failed
+        self._logger = subsystem._logger
+        self._dry_run = subsystem._dry_run
+
+        self.hash_inputs = {}
+        self.hash_outputs = {}
+        self.artifact_keys = {}
+        self.total_build = 0
+        self.restored = 0
+        self.success = True
+        # every asset was looked at, without stopping early
+        self.completed = False
+
+        # the job compiling each asset, the assets waiting for other assets
+        # and the files of other assets each of those was released with
+        self._jobs: Mapping[Tuple[int, str], str] = {}
+        self._held: Mapping[Tuple[int, str], Tuple] = {}
+        self._tracker = DependencyTracker(self._release)
+        self.depends: Mapping[Tuple[int, str], Sequence[Path]] = {}
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops discovering assets and waits for the work in progress to finish.
+        Exceptions raised while prebuilding are raised again here.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def run(self):
+        try:
+            self._run()
+        except BaseException as e:
+            self._error = e
+            self._fail()
+        finally:
+            if self._finished is not None:
+                self._finished()
+
+        self._logger.info(
+            f"{len(self.hash_inputs)} input files, {len(self.hash_outputs)} output files"
+        )
+        if self.restored > 0:
+            self._logger.info(
+                f"restored {self.restored} asset(s) from the artifact cache"
+            )
+        self._logger.info(f"{self.total_build} files total will be rebuilt")
+
+    def _fail(self, message: str = None):
+        if message is not None:
+            self._logger.error(message)
+        self.success = False
+        self._stopped.set()
+        if self._failed is not None:
+            self._failed()
+
+    def _validate(self, paths: Sequence[Path]) -> bool:
+        file_cache = self._subsystem._file_cache
+        if self._dry_run:
+            return all(file_cache.check(f) for f in paths)
+        # validate everything, so unchanged files get their signatures refreshed
+        return all([file_cache.validate(f) for f in paths])
+
+    def _submit_job(self, job: AssetJob):
+        with self._lock:
+            for asset in job.assets:
+                self._jobs[job.index, asset.get_id()] = job.key
+        self._submit(job)
+        # assets waiting for these can be submitted after them now
+        for asset in job.assets:
+            self._tracker.decide((job.index, asset.get_id()))
+
+    def _context_depends(
+        self, index: int, context: AssetBuildContext
+    ) -> Optional[Tuple[Sequence[int], Callable[[Path], bool], Sequence[Path]]]:
+        """
+        Reads the depends patterns of a context. Returns the contexts whose outputs
+        its assets depend on, a matcher for those outputs, and the files matching
+        that are outputs of assets not looked at in this build.
+        """
+        patterns = context.config.get("depends")
+        if not patterns:
+            return None
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        else:
+            patterns = list(patterns)
+
+        # matched against outputs, which are resolved
+        dest = Path(context.config.dest).resolve()
+        matcher = compile_globs(patterns)
+
+        def match(path: Path) -> bool:
+            try:
+                relpath = path.relative_to(dest)
+            except ValueError:
+                return False
+            return matcher.fullmatch(relpath.as_posix()) is not None
+
+        existing = []
+        if self._assets is not None and dest.exists():
+            existing = list(self._subsystem.env.scanner.glob(dest, patterns))
+        return range(index), match, existing
+
+    def _run(self):
+        subsystem = self._subsystem
+        futures = []
+        with ThreadPoolExecutor(_prebuild_workers) as executor:
+            for index, context in enumerate(self._contexts):
+                if not isinstance(context.driver, (BatchedDriver, SerialDriver)):
+                    raise Exception("Unknown driver type")
+
+                estimator = _DurationEstimator(subsystem, index)
+                options = subsystem._artifact_options(context)
+                depends = self._context_depends(index, context)
+
+                if self._assets is not None:
+                    paths = self._assets.get(index, [])
+                else:
+                    paths = subsystem._discover_assets(context)
+
+                context_futures = []
+                for path in paths:
+                    if self._stopped.is_set():
+                        break
+                    context_futures.append(
+                        executor.submit(
+                            self._prebuild,
+                            index,
+                            context,
+                            estimator,
+                            options,
+                            depends,
+                            Asset(path, subsystem.env.root),
+                        )
+                    )
+                if (
+                    not context_futures
+                    and self._assets is None
+                    and not self._stopped.is_set()
+                ):
+                    self._logger.warning(
+                        f"no files found for a context with type {context.config.type}"
+                    )
+
+                futures += context_futures
+                self._settle_when_done(index, context, context_futures)
+
+        # raise anything that went wrong on the workers
+        for f in futures:
+            f.result()
+        if self._error is not None:
+            raise self._error
+        if self._stopped.is_set():
+            return
+
+        # whatever is still held depends on itself through other held assets
+        cycle = self._tracker.finish()
+        if cycle and not self._stopped.is_set():
+            cycle = ", ".join(aid for _, aid in cycle)
+            self._fail(f"Circular dependency between assets: {cycle}")
+        self.completed = not self._stopped.is_set()
+
+    def _settle_when_done(
+        self,
+        index: int,
+        context: AssetBuildContext,
+        futures: Sequence[Future],
+    ):
+        """
+        Settles a context once every asset of it has been prebuilt, without
+        waiting for the contexts after it
+        """
+        remaining = [len(futures) + 1]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            try:
+                self._settle(index, context, futures)
+            except BaseException as e:
+                # callbacks of futures can't raise
+                self._error = e
+                self._fail()
+
+        for f in futures:
+            f.add_done_callback(done)
+        done(None)
+
+    def _settle(
+        self,
+        index: int,
+        context: AssetBuildContext,
+        futures: Sequence[Future],
+    ):
+        subsystem = self._subsystem
+
+        # batches can only be formed once every asset of the context is known
+        if isinstance(context.driver, BatchedDriver) and not self._stopped.is_set():
+            results = [f.result() for f in futures if f.exception() is None]
+            results = [r for r in results if r is not None]
+            if results:
+                estimates = {asset.get_id(): r for asset, *r in results}
+                assets = [asset for asset, *_ in results]
+                for batch in subsystem._split_batches(context.driver, assets):
+                    self._submit_job(
+                        subsystem._make_job(index, context, batch, estimates)
+                    )
+
+        self._tracker.settle(index)
+
+    def _release(self, released: Sequence[HeldAsset]):
+        """
+        Submits held assets once the assets they depend on have been decided.
+        They are compiled if they are invalid or an asset they depend on is
+        compiled, and their jobs wait for the jobs of those assets.
+        """
+        if self._stopped.is_set():
+            return
+        subsystem = self._subsystem
+
+        with self._lock:
+            compiled = set(self._jobs)
+            entries = [(held, self._held.pop(held.key)) for held in released]
+
+        groups = {}
+        for held, (context, options, asset, inputs, estimate) in entries:
+            key = held.key
+            for f in held.unproduced:
+                if not os.path.exists(f):
+                    self._fail(f"Required dependency '{f}' could not be located!")
+                    return
+
+            paths = held.paths
+            inputs = inputs + paths
+            outputs = self.hash_outputs[key]
+            self.hash_inputs[key] = inputs
+            self.depends[key] = paths
+            if subsystem._watching:
+                subsystem._track_inputs(key[0], asset.path, inputs)
+
+            # validated only now, after the assets it depends on were restored
+            # from the artifact cache or found up to date
+            if not held.producers & compiled:
+                valid = self._validate(inputs + outputs)
+                if valid and subsystem._depends_unchanged(key, paths):
+                    self._tracker.decide(key)
+                    continue
+                if subsystem._artifacts is not None and not self._dry_run:
+                    restored, artifact = subsystem._restore_artifact(
+                        context, options, inputs, outputs
+                    )
+                    if restored:
+                        subsystem._record_depends(key, paths)
+                        with self._lock:
+                            self.restored += 1
+                        self._tracker.decide(key)
+                        continue
+                    self.artifact_keys[key] = artifact
+
+            with self._lock:
+                self.total_build += 1
+            groups.setdefault(key[0], []).append((asset, estimate, held.producers))
+
+        # the assets released together only depend on assets submitted before them
+        for index, group in sorted(groups.items()):
+            if self._stopped.is_set():
+                return
+            context = self._contexts[index]
+            assets = [asset for asset, *_ in group]
+            estimates = {asset.get_id(): estimate for asset, estimate, _ in group}
+            producers = {asset.get_id(): producers for asset, _, producers in group}
+            if isinstance(context.driver, BatchedDriver):
+                batches = subsystem._split_batches(context.driver, assets)
+            else:
+                batches = [[asset] for asset in assets]
+
+            for batch in batches:
+                job = subsystem._make_job(index, context, batch, estimates)
+                with self._lock:
+                    job.depends = {
+                        self._jobs[producer]
+                        for asset in batch
+                        for producer in producers[asset.get_id()]
+                        if producer in self._jobs
+                    }
+                self._submit_job(job)
+
+    def _prebuild(
+        self,
+        index: int,
+        context: AssetBuildContext,
+        estimator: _DurationEstimator,
+        options: str,
+        depends: Optional[Tuple[Sequence[int], Callable[[Path], bool], Sequence[Path]]],
+        asset: Asset,
+    ):
+        if self._stopped.is_set():
+            return None
+        subsystem = self._subsystem
+
+        result = context.driver.precompile(context, asset)
+        if not result:
+            self._fail("Asset dependency error!")
+            return None
+
+        inputs = [f.resolve() for f in result.inputs]
+        paths = [f.resolve() for f in result.depends]
+        if depends is not None:
+            paths += [f for f in depends[2] if f not in paths]
+        if subsystem._watching:
+            # before checking them, so creating a missing dependency triggers a rebuild
+            subsystem._track_inputs(index, asset.path, inputs + paths)
+        for f in inputs:
+            if not os.path.exists(f):
+                self._fail(f"Required dependency '{f}' could not be located!")
+                return None
+        outputs = [f.resolve() for f in result.outputs]
+
+        # the same file may be an asset of several contexts
+        aid = asset.get_id()
+        key = (index, aid)
+        self.hash_inputs[key] = inputs
+        self.hash_outputs[key] = outputs
+        self._tracker.produces(key, outputs)
+        duration, size = estimator.observe(asset, inputs)
+
+        if paths or depends is not None:
+            # whether it needs compiling depends on the assets producing those files
+            estimate = (duration, estimator.estimate(duration, size))
+            with self._lock:
+                self._held[key] = (context, options, asset, inputs, estimate)
+            if depends is not None:
+                self._tracker.hold(key, paths, depends[0], depends[1])
+            else:
+                self._tracker.hold(key, paths)
+            return None
+
+        if self._validate(inputs + outputs):
+            self._tracker.decide(key)
+            return None
+
+        if subsystem._artifacts is not None and not self._dry_run:
+            restored, artifact = subsystem._restore_artifact(
+                context, options, inputs, outputs
+            )
+            if restored:
+                with self._lock:
+                    self.restored += 1
+                self._tracker.decide(key)
+                return None
+            self.artifact_keys[key] = artifact
+
+        with self._lock:
+            self.total_build += 1
+
+        if self._stopped.is_set():
+            return None
+        if isinstance(context.driver, BatchedDriver):
+            return asset, duration, estimator.estimate(duration, size)
+
+        estimates = {aid: (duration, estimator.estimate(duration, size))}
+        self._submit_job(subsystem._make_job(index, context, [asset], estimates))
+        return None
 
 
 class AssetSubsystem(BuildSubsystem):
@@ -74,7 +618,55 @@ class AssetSubsystem(BuildSubsystem):
         self._args = self.env.config.args
         self._dry_run = self._args.dry_run
 
-        self._file_cache = FileCache(self.env.cache, self._cache["files"])
+        self._file_cache = FileCache(self.env.cache, self._cache.namespace("files"))
+        self._durations = self._cache.namespace("durations")
+        # digests of the files of other assets each asset was last compiled from
+        self._depends = self._cache.namespace("depends")
+
+        # contexts and drivers are kept for rebuilds in watch mode
+        self._contexts = None
+        self._watching = self._args.watch
+        # input files of each asset, and the assets reading each input file
+        self._asset_inputs: Mapping[Tuple[int, Path], Sequence[Path]] = {}
+        self._dependents: Mapping[Path, Set[Tuple[int, Path]]] = {}
+        self._inputs_lock = threading.Lock()
+
+        self._artifacts = None
+        artifacts = self.config.get("artifact_cache")
+        if artifacts is not None:
+            self._artifacts = ArtifactCache(
+                self.env.root,
+                Path(artifacts.path).resolve(),
+                artifacts.max_size * 1024 * 1024,
+                self.env.fingerprints,
+                self.env.cache.hash_algorithm,
+            )
+
+    def _get_config_raw(self) -> Any:
+        config = super()._get_config_raw()
+        if isinstance(config, DotMap):
+            config = config.toDict()
+        config = {k: v for k, v in config.items() if k not in _operational_keys}
+
+        assets = []
+        for entry in config.get("assets", []):
+            entry = {k: v for k, v in entry.items() if k not in _operational_asset_keys}
+            options = entry.get("options")
+            if isinstance(options, dict):
+                stripped = {
+                    k: v
+                    for k, v in options.items()
+                    if k not in _operational_driver_options
+                }
+                # options holding nothing but limits hash like no options at all
+                if stripped or not options:
+                    entry["options"] = stripped
+                else:
+                    del entry["options"]
+            assets.append(entry)
+        if "assets" in config:
+            config["assets"] = assets
+        return config
 
     def _get_asset_driver(self, name: str) -> BaseDriver:
         driver = self._drivers.get(name)
@@ -102,196 +694,335 @@ class AssetSubsystem(BuildSubsystem):
                 self._validators[config.type] = DefaultValidatingDraft7Validator(
                     json.load(f)
                 )
-        if config.get("options") is not None:
-            self._validators[config.type].validate(config.options._data)
+        options = config.get("options")
+        options = options._data if options is not None else {}
+        self._validators[config.type].validate(options)
 
         srcpath = Path(config.src)
         if not srcpath.exists():
             raise Exception(f'The asset source folder "{srcpath}" does not exist.')
 
-        # find everything by the patterns
-        patterns = []
+        # create context, its assets are discovered later
+        context = AssetBuildContext(config)
+        context.max_concurrency = options.get("max_concurrency")
+        context.memory = options.get("memory", 0)
+        return context
+
+    def _asset_patterns(self, context: AssetBuildContext) -> Sequence[str]:
+        config = context.config
         if isinstance(config.files, str):
-            patterns.append(config.files)
+            return [config.files]
         elif isinstance(config.files, Sequence):
-            patterns += config.files
-        else:
-            raise NotImplementedError()
+            return list(config.files)
+        raise NotImplementedError()
 
-        files = []
-        for pattern in patterns:
-            for path in pathlib.Path(srcpath).absolute().rglob(pattern):
-                if not path.is_file():
-                    continue
-                files.append(path)
-
-        # create context and add assets
-        context = AssetBuildContext(config)
-        for f in files:
-            context.assets.append(Asset(f, {}))
-        return context
+    def _discover_assets(self, context: AssetBuildContext) -> Iterator[Path]:
+        """
+        Finds the files matching the patterns of a context
+        """
+        srcpath = Path(context.config.src)
 
-    def _build_assets(
-        self,
-        contexts: Sequence[AssetBuildContext],
-        callback: Callable[[Callable[[Mapping[str, Any]], bool], Sequence[Any]], None],
-    ):
-        for context in contexts:
-            if len(context.assets) <= 0:
-                self._logger.warning(
-                    f"no files found for a context with type {context.config.type}"
-                )
-                continue
+        # every pattern is matched in a single walk of the source folder
+        yield from self.env.scanner.glob(
+            srcpath.absolute(), self._asset_patterns(context)
+        )
 
-            if isinstance(context.driver, BatchedDriver):
-                callback(_run_async_batched, (context, context.driver, context.assets))
-            elif isinstance(context.driver, SerialDriver):
-                for asset in context.assets:
-                    callback(_run_async_serial, (context, context.driver, asset))
-            else:
-                raise Exception("Unknown driver type")
+    def _track_inputs(self, index: int, path: Path, inputs: Sequence[Path]):
+        """
+        Records the input files of an asset, replacing those of its last precompile
+        """
+        key = (index, path)
+        with self._inputs_lock:
+            for f in self._asset_inputs.pop(key, []):
+                dependents = self._dependents.get(f)
+                if dependents is not None:
+                    dependents.discard(key)
+                    if not dependents:
+                        del self._dependents[f]
+            if inputs is None:
+                return
+            self._asset_inputs[key] = inputs
+            for f in inputs:
+                self._dependents.setdefault(f, set()).add(key)
 
-    def _build_assets_sync(self, contexts: Sequence[AssetBuildContext]) -> bool:
+    def _changed_assets(self, changed: Set[Path]) -> Mapping[int, Sequence[Path]]:
         """
-        Builds assets synchronously.
+        Finds the assets of each context affected by some changed files:
+        assets reading any of them, and new or modified files matching a context
         """
-        jobs = []
-        lock = multiprocessing.Lock()
-        _async_mod_init(lock)
+        affected = {}
+        with self._inputs_lock:
+            for f in changed:
+                for index, path in self._dependents.get(f, ()):
+                    affected.setdefault(index, set()).add(path)
+
+        for index, context in enumerate(self._contexts):
+            srcpath = Path(context.config.src)
+            resolved = srcpath.resolve()
+            matcher = compile_globs(self._asset_patterns(context))
+            for f in changed:
+                if resolved not in f.parents:
+                    continue
+                relpath = f.relative_to(resolved)
+                if matcher.fullmatch(relpath.as_posix()):
+                    # use the same path discovery would have found it by
+                    affected.setdefault(index, set()).add(
+                        srcpath.absolute().joinpath(relpath)
+                    )
 
-        def callback(func: Callable[[Mapping[str, Any]], bool], params: Sequence[Any]):
-            jobs.append(func(*params))
+        # deleted assets only need forgetting
+        result = {}
+        for index, paths in affected.items():
+            for path in paths:
+                if path.exists():
+                    result.setdefault(index, []).append(path)
+                else:
+                    self._track_inputs(index, path, None)
+        return result
 
-        self._build_assets(contexts, callback)
-        return all(job for job in jobs)
+    def _depends_digests(self, paths: Sequence[Path]) -> Mapping[str, str]:
+        # files the file cache has seen unchanged aren't read again
+        algorithm = self.env.cache.hash_algorithm
+        return {
+            os.path.relpath(f, self.env.root): self._file_cache.cached_digest(f)
+            or self.env.fingerprints.digest(f, algorithm)
+            for f in paths
+        }
 
-    def _build_assets_async(self, contexts: Sequence[AssetBuildContext]) -> bool:
+    def _record_depends(self, key: Tuple[int, str], paths: Sequence[Path]):
+        self._depends[_entry_key(key)] = self._depends_digests(paths)
+
+    def _depends_unchanged(self, key: Tuple[int, str], paths: Sequence[Path]) -> bool:
         """
-        Builds assets asynchronously.
+        Whether the files of other assets an asset depends on are the ones it was
+        last compiled from. The file cache can't tell, as it holds the hashes the
+        assets producing them stored.
         """
-        jobs = []
-        lock = multiprocessing.Lock()
-        pool = multiprocessing.Pool(
-            self._args.threads, initializer=_async_mod_init, initargs=(lock,)
-        )
+        recorded = self._depends.get(_entry_key(key))
+        return recorded == self._depends_digests(paths)
 
-        def callback(func: Callable[[Mapping[str, Any]], bool], params: Sequence[Any]):
-            jobs.append(pool.apply_async(func, params))
+    def _forget_unseen(self, prebuild: "_Prebuild"):
+        """
+        Drops the durations of assets a full build didn't see, which no longer
+        exist, and the dependencies of assets that no longer have any
+        """
+        for namespace, seen in (
+            (self._durations, prebuild.hash_outputs),
+            (self._depends, prebuild.depends),
+        ):
+            seen = {_entry_key(key) for key in seen}
+            for k in [k for k in namespace if k not in seen]:
+                del namespace[k]
 
-        try:
-            self._build_assets(contexts, callback)
-            pool.close()
-        except KeyboardInterrupt:
-            pool.terminate()
-        pool.join()
+    def _split_batches(
+        self, driver: BatchedDriver, assets: Sequence[Asset]
+    ) -> Sequence[Sequence[Asset]]:
+        """
+        Splits the assets of a batched driver into batches that fit the driver's limits,
+        and into enough batches to keep every thread busy
+        """
+        size = math.ceil(len(assets) / self._args.threads)
+        size = max(1, min(size, driver.max_batch_size()))
+        max_args = driver.max_batch_args()
 
-        return all(job.get() for job in jobs)
+        batches = []
+        batch = []
+        length = 0
+        for asset in assets:
+            arg = len(str(asset.path)) + 1
+            if batch and (len(batch) >= size or length + arg > max_args):
+                batches.append(batch)
+                batch = []
+                length = 0
+            batch.append(asset)
+            length += arg
+        if batch:
+            batches.append(batch)
+        return batches
 
-    def _run_asset_build(self, clean: bool = False) -> bool:
-        contexts = []
-        for entry in self.config.assets:
-            contexts.append(self._load_asset_context(entry))
+    def _job_lane(self, context: AssetBuildContext) -> str:
+        """
+        Picks the lane the jobs of a context run on
+        """
+        if not context.driver.threadable() or self._args.threads <= 1:
+            return SERIAL
+        # drivers that only wait on external tools don't need their own processes
+        executor = self._args.executor
+        if executor == "process" or (executor == "auto" and context.driver.cpu_bound()):
+            return PROCESS
+        return THREAD
 
-        hash_inputs = {}
-        hash_outputs = {}
-        total_build = 0
+    def _make_job(
+        self,
+        index: int,
+        context: AssetBuildContext,
+        assets: Sequence[Asset],
+        estimates: Mapping[Any, Tuple[Any, float]],
+    ) -> AssetJob:
+        """
+        Creates the job for some assets of a context.
+        estimates maps each asset to its recorded duration, if known, and its estimate.
+        """
+        key = f"{index}:{assets[0].get_id()}"
+        job = AssetJob(index, key, assets, self._job_lane(context))
+        durations = [estimates[asset.get_id()][0] for asset in assets]
+        job.estimate = sum(estimates[asset.get_id()][1] for asset in assets)
+        if all(d is not None for d in durations):
+            job.expected = sum(durations)
+        job.driver = context.config.type
+        job.max_concurrency = context.max_concurrency
+        job.memory = context.memory
+        return job
 
-        # prebuild
+    def _worker_contexts(
+        self, contexts: Sequence[AssetBuildContext]
+    ) -> Sequence[AssetBuildContext]:
+        """
+        Strips the asset lists from the contexts, so workers only receive
+        the configuration and driver of each context
+        """
+        result = []
         for context in contexts:
-            assets = context.assets.copy()
+            worker_context = AssetBuildContext(context.config)
+            worker_context.driver = context.driver
+            result.append(worker_context)
+        return result
 
-            context.assets = []
-            context.driver = self._get_asset_driver(context.config.type)
+    def _artifact_options(self, context: AssetBuildContext) -> str:
+        # scheduling limits don't change what gets compiled
+        options = context.config.get("options")
+        if options is not None:
+            options = {
+                k: v
+                for k, v in options._data.items()
+                if k not in _operational_driver_options
+            }
+        return utilities.hash_object_sha256(options)
 
-            for asset in assets:
-                result = context.driver.precompile(context, asset)
+    def _artifact_key(
+        self,
+        context: AssetBuildContext,
+        options: str,
+        inputs: Sequence[Path],
+        outputs: Sequence[Path],
+    ) -> Optional[str]:
+        return self._artifacts.key(
+            context.config.type, options, Path(context.driver.tool), inputs, outputs
+        )
+
+    def _restore_artifact(
+        self,
+        context: AssetBuildContext,
+        options: str,
+        inputs: Sequence[Path],
+        outputs: Sequence[Path],
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Restores an invalidated asset from the artifact cache.
+        Returns whether it was restored, and its artifact key if it is known.
+        """
+        key = self._artifact_key(context, options, inputs, outputs)
+        if not self._artifacts.restore(key, outputs):
+            return False, key
+        for f in inputs + outputs:
+            self._file_cache.put(f)
+        return True, key
+
+    def _clean_assets(self, contexts: Sequence[AssetBuildContext]) -> bool:
+        for context in contexts:
+            for path in self._discover_assets(context):
+                result = context.driver.precompile(context, Asset(path, self.env.root))
                 if not result:
                     self._logger.error("Asset dependency error!")
                     return False
 
-                # clean outputs if requested
-                if clean is True:
-                    for f in result.outputs:
-                        if not f.exists():
-                            continue
-                        f.unlink()
-                    continue
-
-                # check hashes
-                invalidated = False
-                for f in result.inputs:
-                    f = f.resolve()
-                    if not os.path.exists(f):
-                        self._logger.error(
-                            f"Required dependency '{f}' could not be located!"
-                        )
-                        return False
-                    if not self._file_cache.validate(f):
-                        invalidated = True
-
                 for f in result.outputs:
-                    f = f.resolve()
-                    if not self._file_cache.validate(f):
-                        invalidated = True
+                    if not f.exists():
+                        continue
+                    f.unlink()
 
-                aid = asset.get_id()
-                hash_inputs[aid] = result.inputs
-                hash_outputs[aid] = result.outputs
+        self._logger.info("assets cleaned")
+        return True
 
-                if invalidated:
-                    total_build += 1
-                    context.assets.append(asset)
+    def _load_contexts(self) -> Sequence[AssetBuildContext]:
+        if self._contexts is None:
+            contexts = []
+            for entry in self.config.assets:
+                context = self._load_asset_context(entry)
+                context.driver = self._get_asset_driver(context.config.type)
+                contexts.append(context)
+            self._contexts = contexts
+        return self._contexts
 
-        if clean is True:
-            self._logger.info("assets cleaned")
-            return True
+    def _run_asset_build(
+        self, clean: bool = False, assets: Mapping[int, Sequence[Path]] = None
+    ) -> bool:
+        contexts = self._load_contexts()
 
-        self._logger.info(
-            f"{len(hash_inputs)} input files, {len(hash_outputs)} output files"
-        )
-        self._logger.info(f"{total_build} files total will be rebuilt")
+        if clean is True:
+            return self._clean_assets(contexts)
 
-        if self._dry_run or total_build == 0:
-            return True
+        if self._dry_run:
+            prebuild = _Prebuild(self, contexts, lambda job: None, assets=assets)
+            prebuild.run()
+            prebuild.stop()
+            return prebuild.success
 
         # build
-        threaded = self._args.threads > 1
-        if threaded:
+        if self._args.threads > 1:
             self._logger.info(
                 f"running multithreaded build with {self._args.threads} threads"
             )
         else:
             self._logger.info("running singlethreaded build")
 
-        # sort out drivers that should run synchronously regardless of threading
-        sync_assets = [
-            context
-            for context in contexts
-            if not context.driver.threadable() or not threaded
-        ]
-        async_assets = [
-            context for context in contexts if context.driver.threadable() and threaded
-        ]
-
-        multiprocessing.log_to_stderr(logging.INFO)
-        if not self._build_assets_sync(sync_assets):
-            self._logger.error("Build failed")
-            return False
-        if not self._build_assets_async(async_assets):
+        scheduler = AssetScheduler(
+            self._worker_contexts(contexts),
+            self._args.threads,
+            self._args.fail_fast,
+            self.config.straggler_factor,
+            self.env.root,
+            self._logger,
+            self.config.get("memory_budget"),
+            self.env.jobserver,
+        )
+        # compiles start as soon as the first invalidated assets are found
+        prebuild = _Prebuild(
+            self, contexts, scheduler.submit, scheduler.close, scheduler.cancel, assets
+        )
+        checkpoint = _BuildCheckpoint(
+            self,
+            prebuild.hash_inputs,
+            prebuild.hash_outputs,
+            prebuild.artifact_keys,
+            prebuild.depends,
+        )
+
+        if self._artifacts is not None:
+            self._artifacts.reset_stats()
+        # every call adds another handler, and watch mode builds many times
+        if not multiprocessing.get_logger().handlers:
+            multiprocessing.log_to_stderr(logging.INFO)
+        prebuild.start()
+        try:
+            success = scheduler.run(checkpoint.complete)
+        finally:
+            try:
+                prebuild.stop()
+            finally:
+                # whatever happened, keep the hashes of everything that did compile
+                checkpoint.close()
+                if self._artifacts is not None:
+                    self._artifacts.evict()
+                    self._artifacts.log_stats(self._logger)
+
+        # every asset was seen, unless this rebuilt some of them or discovery stopped
+        if assets is None and prebuild.completed:
+            self._forget_unseen(prebuild)
+
+        if not success or not prebuild.success:
             self._logger.error("Build failed")
             return False
-
-        self._logger.info("recalculating asset hashes...")
-        for context in contexts:
-            for asset in context.assets:
-                # save updated hashes
-                aid = asset.get_id()
-                for f in hash_inputs[aid]:
-                    self._file_cache.put(f)
-                for f in hash_outputs[aid]:
-                    self._file_cache.put(f)
-
-        self.env.cache.save()
         return True
 
     def build(self, force: bool = False) -> BuildResult:
@@ -305,5 +1036,30 @@ class AssetSubsystem(BuildSubsystem):
     def clean(self) -> bool:
         return self._run_asset_build(True)
 
+    def watched_folders(self) -> Sequence[Tuple[Path, bool]]:
+        if self._contexts is None:
+            return []
+        folders = [(Path(c.config.src).resolve(), True) for c in self._contexts]
+
+        # dependencies can live outside the source folders, like shared includes
+        roots = [folder for folder, _ in folders]
+        with self._inputs_lock:
+            parents = {f.parent for f in self._dependents}
+        for parent in parents:
+            if not any(root == parent or root in parent.parents for root in roots):
+                folders.append((parent, False))
+        return folders
+
+    def rebuild(self, changed: Optional[Set[Path]]) -> bool:
+        if changed is None:
+            return self._run_asset_build()
+
+        assets = self._changed_assets(changed)
+        if not assets:
+            return True
+        count = sum(len(paths) for paths in assets.values())
+        self._logger.info(f"{len(changed)} file(s) changed, checking {count} asset(s)")
+        return self._run_asset_build(assets=assets)
+
 
 _subsystem = AssetSubsystem
@@ -23,7 +23,7 @@ class SyncFolderSubsystem(BuildSubsystem):
         if not to_dir.exists():
             to_dir.mkdir()
 
-        files = utilities.rglob_multi(from_dir, self.config.files)
+        files = utilities.rglob_multi(from_dir, self.config.files, self.env.scanner)
         self._logger.debug(f"{len(files)} file(s) to copy")
 
         for src in files:
@@ -6,7 +6,6 @@ import cas.common.utilities as utilities
 
 import os
 import vdf
-import hashlib
 
 
 class VPKArchive:
@@ -24,18 +23,9 @@ class VPKArchive:
         self.output_path = output_path
         self.files = files
 
-    def _md5_file(self, path: str):
-        hash = hashlib.md5()
-        with open(path, "rb") as f:
-            while True:
-                data = f.read(65536)
-                if not data:
-                    break
-                hash.update(data)
-        return hash.hexdigest()
-
     def _gen_control_file(self, output: Path, files: List[Path]):
         entries = {}
+        fingerprints = self.sys.env.fingerprints
         for f in files:
             # Ensure the control file itself and VPKs are excluded
             if (
@@ -46,7 +36,7 @@ class VPKArchive:
                 continue
 
             rel = str(os.path.relpath(f, self.input_path)).replace("\\", "/")
-            entries[rel] = {"destpath": rel, "md5": self._md5_file(str(f))}
+            entries[rel] = {"destpath": rel, "md5": fingerprints.digest(f, "md5")}
 
         # VPK needs the files to stay in the same order
         res = dict(sorted(entries.items()))
@@ -102,7 +92,9 @@ class VPKBuildSubsystem(BuildSubsystem):
         assert input_path.exists()
         assert output_path.exists()
 
-        files = utilities.rglob_multi(input_path, config.get("files", []))
+        files = utilities.rglob_multi(
+            input_path, config.get("files", []), self.env.scanner
+        )
         if len(files) == 0:
             self._logger.warning("No files to pack!")
             return
@@ -142,7 +134,7 @@ class VPKBuildSubsystem(BuildSubsystem):
             else:
                 output_path = input_path
 
-            for path in output_path.rglob(vpk["prefix"] + "*.vpk"):
+            for path in self.env.scanner.glob(output_path, [vpk["prefix"] + "*.vpk"]):
                 path.unlink()
 
             ctl = output_path.joinpath("control_" + vpk["prefix"] + ".vdf")
@@ -0,0 +1,77 @@
+from cas.common.assets.artifacts import ArtifactCache
+from cas.common.fingerprint import FingerprintService
+
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+class ArtifactCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name).joinpath("project")
+        self.output = self.root.joinpath("out", "a.bin")
+        self.output.parent.mkdir(parents=True)
+        self.output.write_bytes(b"compiled")
+
+        self.cache = ArtifactCache(
+            self.root,
+            Path(self._tmp.name).joinpath("artifacts"),
+            1024 * 1024,
+            FingerprintService(),
+            "sha256",
+        )
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_restore(self):
+        self.cache.store("abcd", [self.output])
+        self.output.unlink()
+
+        self.assertTrue(self.cache.restore("abcd", [self.output]))
+        self.assertEqual(self.output.read_bytes(), b"compiled")
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_restore_evicted_while_copying_is_a_miss(self):
+        self.cache.store("abcd", [self.output])
+        entry = self.cache._entry_path("abcd")
+
+        # the entry disappears between reading its manifest and copying its outputs
+        copyfile = shutil.copyfile
+
+        def evicted(src, dest):
+            shutil.rmtree(entry)
+            return copyfile(src, dest)
+
+        with mock.patch("shutil.copyfile", evicted):
+            self.assertFalse(self.cache.restore("abcd", [self.output]))
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_missing_tool_is_a_miss(self):
+        tool = self.root.joinpath("bin", "compiler")
+        key = self.cache.key("model", {}, tool, [self.output], [self.output])
+        self.assertIsNone(key)
+
+        self.assertFalse(self.cache.restore(key, [self.output]))
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_evict_only_after_storing(self):
+        self.cache.store("abcd", [self.output])
+        self.cache.reset_stats()
+        self.cache._max_size = 0
+
+        self.cache.evict()
+        self.assertTrue(self.cache._entry_path("abcd").exists())
+
+        self.cache.store("efgh", [self.output])
+        self.cache.evict()
+        self.assertFalse(os.path.exists(self.cache._entry_path("abcd")))
+
+
+if __name__ == "__main__":
+    unittest.main()
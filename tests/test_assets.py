@@ -0,0 +1,146 @@
+import cas.cli as cli
+import cas.common.utilities as utilities
+from cas.common.sequencer import Sequencer
+from cas.subsystems.assets import AssetSubsystem, _Prebuild
+
+import json
+import multiprocessing
+import os
+import stat
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# copies each caption file to its output, failing on files containing FAIL
+_CAPTIONCOMPILER = """#!/bin/sh
+grep -q FAIL "$1" && exit 1
+cp "$1" "${1%.txt}.dat"
+"""
+
+
+@unittest.skipIf(utilities.is_platform_windows(), "the tools are shell scripts")
+class AssetBuildTest(unittest.TestCase):
+    def setUp(self):
+        # builds attach a stderr handler to the multiprocessing logger, which would
+        # outlive the stream a test runner captured
+        logger = multiprocessing.get_logger()
+        self.addCleanup(setattr, logger, "handlers", list(logger.handlers))
+
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name).resolve()
+        self.resource = self.root.joinpath("game", "mymod", "resource")
+        self.resource.mkdir(parents=True)
+        self.root.joinpath("src").mkdir()
+
+        bindir = self.root.joinpath("game", "bin", utilities.resolve_platform_name())
+        bindir.mkdir(parents=True)
+        tool = bindir.joinpath("captioncompiler")
+        tool.write_text(_CAPTIONCOMPILER)
+        tool.chmod(tool.stat().st_mode | stat.S_IEXEC)
+
+        self.root.joinpath("content").mkdir()
+        self.write_config({"type": "caption", "src": "$(path.game)"})
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def write_config(self, *entries):
+        config = {
+            "options": {"project": "mymod"},
+            "subsystems": {
+                "assets": {
+                    "module": "cas.subsystems.assets",
+                    "categories": ["assets"],
+                    "options": {
+                        "assets": [
+                            dict({"files": "mymod/resource/*.txt"}, **entry)
+                            for entry in entries
+                        ]
+                    },
+                }
+            },
+        }
+        with open(self.root.joinpath("content", "cas.jsonc"), "w") as f:
+            json.dump(config, f)
+
+    def build(self, *args) -> Sequencer:
+        parser = cli._create_parser()
+        args = parser.parse_args(["-p", str(self.root), "--no-daemon", *args])
+        sequencer = Sequencer(self.root, cli._load_config(self.root, args))
+        self.success = sequencer.run()
+        sequencer.env.jobserver.dispose()
+        return sequencer
+
+    def durations(self, sequencer: Sequencer) -> set:
+        namespace = sequencer.env.cache.namespace(
+            "subsystems/cas.subsystems.assets/durations"
+        )
+        return set(namespace)
+
+    def test_fail_fast_keeps_durations_of_undiscovered_assets(self):
+        for i in range(10):
+            self.resource.joinpath(f"caption_{i}.txt").write_text(f"caption {i}")
+        recorded = self.durations(self.build())
+        self.assertTrue(self.success)
+        self.assertEqual(len(recorded), 10)
+
+        self.resource.joinpath("caption_0.txt").write_text("FAIL")
+
+        # discovery only gets past the failing asset once the build has stopped
+        stopped = threading.Event()
+        discover = AssetSubsystem._discover_assets
+        stop = _Prebuild.stop
+
+        def discover_slowly(subsystem, context):
+            paths = sorted(discover(subsystem, context))
+            yield paths[0]
+            stopped.wait(30)
+            yield from paths[1:]
+
+        def stop_prebuild(prebuild):
+            stopped.set()
+            stop(prebuild)
+
+        with mock.patch.object(
+            AssetSubsystem, "_discover_assets", discover_slowly
+        ), mock.patch.object(_Prebuild, "stop", stop_prebuild):
+            sequencer = self.build("--fail-fast", "-t", "2")
+        self.assertFalse(self.success)
+        self.assertEqual(self.durations(sequencer), recorded)
+
+        # a full build that saw every asset still forgets the deleted ones
+        self.resource.joinpath("caption_0.txt").write_text("caption 0")
+        os.remove(self.resource.joinpath("caption_9.txt"))
+        sequencer = self.build()
+        self.assertTrue(self.success)
+        self.assertEqual(len(self.durations(sequencer)), 9)
+
+    def test_unchanged_depends_are_not_hashed(self):
+        self.write_config(
+            {
+                "type": "caption",
+                "src": "$(path.game)",
+                "files": "mymod/resource/a_*.txt",
+            },
+            {
+                "type": "caption",
+                "src": "$(path.game)",
+                "files": "mymod/resource/b_*.txt",
+                "depends": "mymod/resource/a_*.dat",
+            },
+        )
+        for i in range(3):
+            self.resource.joinpath(f"a_{i}.txt").write_text(f"caption {i}")
+        self.resource.joinpath("b_0.txt").write_text("caption")
+        self.build()
+        self.assertTrue(self.success)
+
+        sequencer = self.build()
+        self.assertTrue(self.success)
+        self.assertEqual(sequencer.env.fingerprints.computed, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+from cas.common.cache import CacheManager, FileCache
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class CacheBackendTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        self.root.joinpath("content").mkdir()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def manager(self, backend: str) -> CacheManager:
+        manager = CacheManager(self.root, backend=backend)
+        manager.load()
+        self.addCleanup(manager._backend.close)
+        return manager
+
+    def test_round_trip(self):
+        for backend in ("sqlite", "json"):
+            with self.subTest(backend=backend):
+                manager = self.manager(backend)
+                files = manager.namespace("subsystems/assets/files")
+                files["a.txt"] = {"hash": "aaaa", "size": 1}
+                files["b.txt"] = {"hash": "bbbb", "size": 2}
+                manager.namespace("durations")["a"] = 1.5
+                manager.save()
+
+                del files["b.txt"]
+                manager.namespace("durations").clear()
+                manager.save()
+
+                manager = self.manager(backend)
+                self.assertEqual(
+                    dict(manager.namespace("subsystems/assets/files")),
+                    {"a.txt": {"hash": "aaaa", "size": 1}},
+                )
+                self.assertEqual(dict(manager.namespace("durations")), {})
+
+    def test_concurrent_saves_are_merged(self):
+        for backend in ("sqlite", "json"):
+            with self.subTest(backend=backend):
+                first = self.manager(backend)
+                second = self.manager(backend)
+                # namespaces are loaded on first use
+                self.assertEqual(len(second.namespace(backend)), 0)
+
+                first.namespace(backend)["shared"] = "first"
+                first.namespace(backend)["first"] = 1
+                first.save()
+
+                # the second run loaded the namespace before the first one saved
+                self.assertNotIn("first", second.namespace(backend))
+                second.namespace(backend)["shared"] = "second"
+                second.namespace(backend)["second"] = 2
+                second.namespace(f"{backend}/other")["key"] = "value"
+                second.save()
+
+                # saving without changes writes nothing
+                first.save()
+
+                manager = self.manager(backend)
+                self.assertEqual(
+                    dict(manager.namespace(backend)),
+                    {"shared": "second", "first": 1, "second": 2},
+                )
+                self.assertEqual(
+                    dict(manager.namespace(f"{backend}/other")), {"key": "value"}
+                )
+
+    def test_nested_namespaces(self):
+        manager = self.manager("sqlite")
+        manager.namespace("subsystems").namespace("assets")["key"] = "value"
+        manager.save()
+
+        manager = self.manager("sqlite")
+        self.assertEqual(manager.namespace("subsystems/assets")["key"], "value")
+        self.assertEqual(len(manager.namespace("subsystems")), 0)
+
+    def test_legacy_json_is_migrated(self):
+        # older caches nested namespaces and kept file hashes as plain strings
+        legacy = {
+            "subsystems": {
+                "assets": {
+                    "files": {"mymod/a.txt": "aaaa"},
+                    "durations": {"a": 2.0},
+                }
+            }
+        }
+        legacy_file = self.root.joinpath("content", ".cas_cache.json")
+        legacy_file.write_text(json.dumps(legacy))
+
+        manager = self.manager("sqlite")
+        self.assertEqual(
+            dict(manager.namespace("subsystems/assets/files")), {"mymod/a.txt": "aaaa"}
+        )
+        self.assertEqual(
+            dict(manager.namespace("subsystems/assets/durations")), {"a": 2.0}
+        )
+        self.assertFalse(legacy_file.exists())
+        self.assertTrue(legacy_file.with_suffix(".json.bak").exists())
+
+    def test_legacy_json_is_read_by_the_json_backend(self):
+        legacy_file = self.root.joinpath("content", ".cas_cache.json")
+        legacy_file.write_text(json.dumps({"subsystems": {"vpk": {"a": "b"}}}))
+
+        manager = self.manager("json")
+        self.assertEqual(dict(manager.namespace("subsystems/vpk")), {"a": "b"})
+        manager.namespace("subsystems/vpk")["c"] = "d"
+        manager.save()
+
+        with open(legacy_file, "r") as f:
+            self.assertEqual(
+                json.load(f), {"namespaces": {"subsystems/vpk": {"a": "b", "c": "d"}}}
+            )
+
+
+class FileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        self.root.joinpath("content").mkdir()
+
+        self.manager = CacheManager(self.root)
+        self.manager.load()
+        self.addCleanup(self.manager._backend.close)
+        self.cache = FileCache(self.manager, self.manager.namespace("files"))
+
+        self.paths = []
+        for i in range(20):
+            path = self.root.joinpath(f"{i}.txt")
+            path.write_text(f"file {i}")
+            self.paths.append(path)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_put_many_then_validate_many(self):
+        self.assertEqual(
+            self.cache.validate_many(self.paths), {f: False for f in self.paths}
+        )
+        self.cache.put_many(self.paths + self.paths[:5])
+        self.assertEqual(self.manager.fingerprints.computed, 20)
+        self.assertEqual(
+            self.cache.validate_many(self.paths), {f: True for f in self.paths}
+        )
+
+        # unchanged files are validated from their stat signature alone
+        self.assertEqual(self.manager.fingerprints.computed, 20)
+
+    def test_validate_many_notices_changes(self):
+        self.cache.put_many(self.paths)
+        self.paths[3].write_text("changed contents")
+        self.paths[4].unlink()
+
+        result = self.cache.validate_many(self.paths)
+        self.assertFalse(result[self.paths[3]])
+        self.assertFalse(result[self.paths[4]])
+        self.assertEqual(sum(result.values()), 18)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+from cas.common.assets.dependencies import DependencyTracker
+
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+class DependencyTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.waves = []
+        self.tracker = DependencyTracker(self.release)
+
+    def release(self, released):
+        self.waves.append(sorted(held.key for held in released))
+        self.released = {held.key: held for held in released}
+
+    def test_released_once_producer_is_decided(self):
+        self.tracker.hold((1, "model"), [Path("/game/material.vtf")])
+        self.tracker.produces((0, "material"), [Path("/game/material.vtf")])
+        self.assertEqual(self.waves, [])
+
+        # before discovery finishes
+        self.tracker.decide((0, "material"))
+        self.assertEqual(self.waves, [[(1, "model")]])
+        self.assertEqual(self.released[1, "model"].producers, {(0, "material")})
+        self.assertEqual(self.tracker.finish(), [])
+
+    def test_producer_known_before_holding(self):
+        self.tracker.produces((0, "material"), [Path("/game/material.vtf")])
+        self.tracker.decide((0, "material"))
+        self.tracker.hold((1, "model"), [Path("/game/material.vtf")])
+        self.assertEqual(self.waves, [[(1, "model")]])
+
+    def test_unproduced_files_wait_for_discovery(self):
+        self.tracker.hold((0, "model"), [Path("/game/shared.vtf")])
+        self.assertEqual(self.waves, [])
+
+        self.assertEqual(self.tracker.finish(), [])
+        self.assertEqual(self.waves, [[(0, "model")]])
+        self.assertEqual(self.released[0, "model"].producers, set())
+        self.assertEqual(
+            self.released[0, "model"].unproduced, [Path("/game/shared.vtf")]
+        )
+
+    def test_chain_is_released_in_waves(self):
+        a, b, c = (0, "a"), (0, "b"), (0, "c")
+        self.tracker.produces(a, [Path("a.out")])
+        self.tracker.produces(b, [Path("b.out")])
+        self.tracker.produces(c, [Path("c.out")])
+        self.tracker.hold(c, [Path("b.out")])
+        self.tracker.hold(b, [Path("a.out")])
+        self.assertEqual(self.waves, [])
+
+        self.tracker.decide(a)
+        self.assertEqual(self.waves, [[b]])
+        self.tracker.decide(b)
+        self.assertEqual(self.waves, [[b], [c]])
+
+    def test_decisions_during_release_release_dependents(self):
+        a, b, c = (0, "a"), (0, "b"), (0, "c")
+
+        def release(released):
+            self.waves.append(sorted(held.key for held in released))
+            for held in released:
+                self.tracker.decide(held.key)
+
+        self.tracker = DependencyTracker(release)
+        self.tracker.produces(b, [Path("b.out")])
+        self.tracker.hold(c, [Path("b.out")])
+        self.tracker.hold(b, [Path("a.out")])
+        self.tracker.produces(a, [Path("a.out")])
+        self.tracker.decide(a)
+        self.assertEqual(self.waves, [[b], [c]])
+
+    def test_cycle_is_reported(self):
+        a, b, c = (0, "a"), (0, "b"), (1, "c")
+        self.tracker.produces(a, [Path("a.out")])
+        self.tracker.produces(b, [Path("b.out")])
+        self.tracker.hold(a, [Path("b.out")])
+        self.tracker.hold(b, [Path("a.out")])
+        self.tracker.hold(c, [Path("a.out")])
+        self.assertEqual(self.tracker.finish(), [a, b, c])
+        self.assertEqual(self.waves, [])
+
+    def test_own_outputs_are_ignored(self):
+        self.tracker.produces((0, "a"), [Path("a.out")])
+        self.tracker.hold((0, "a"), [Path("a.out")])
+        self.assertEqual(self.waves, [[(0, "a")]])
+
+    def test_patterns_wait_for_earlier_contexts(self):
+        def match(path):
+            return path.suffix == ".ekv"
+
+        self.tracker.hold((2, "model"), [], range(2), match)
+        self.tracker.produces((0, "a"), [Path("a.ekv")])
+        self.tracker.produces((1, "b"), [Path("b.ekv"), Path("b.txt")])
+        self.tracker.decide((0, "a"))
+        self.tracker.decide((1, "b"))
+        self.tracker.settle(0)
+        self.assertEqual(self.waves, [])
+
+        # a context after it is never waited for
+        self.tracker.produces((3, "c"), [Path("c.ekv")])
+        self.tracker.settle(1)
+        self.assertEqual(self.waves, [[(2, "model")]])
+        held = self.released[2, "model"]
+        self.assertEqual(sorted(held.paths), [Path("a.ekv"), Path("b.ekv")])
+        self.assertEqual(held.producers, {(0, "a"), (1, "b")})
+
+    def test_patterns_wait_for_held_producers(self):
+        def match(path):
+            return path.suffix == ".ekv"
+
+        self.tracker.produces((0, "a"), [Path("a.ekv")])
+        self.tracker.hold((0, "a"), [Path("source.txt")])
+        self.tracker.hold((1, "model"), [], range(1), match)
+        self.tracker.settle(0)
+        self.assertEqual(self.waves, [])
+
+        self.tracker.finish()
+        self.assertEqual(self.waves, [[(0, "a")]])
+        self.tracker.decide((0, "a"))
+        self.assertEqual(self.waves, [[(0, "a")], [(1, "model")]])
+
+    def test_concurrent_producers(self):
+        keys = [(0, str(i)) for i in range(200)]
+        lock = threading.Lock()
+        released = []
+
+        def release(wave):
+            with lock:
+                released.extend(held.key for held in wave)
+
+        tracker = DependencyTracker(release)
+        for i, key in enumerate(keys):
+            tracker.hold((1, key[1]), [Path(f"{i}.out")])
+
+        def produce(key):
+            tracker.produces(key, [Path(f"{key[1]}.out")])
+            tracker.decide(key)
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(produce, keys))
+        self.assertEqual(tracker.finish(), [])
+        self.assertEqual(sorted(released), sorted((1, key[1]) for key in keys))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+from cas.common.fingerprint import FingerprintService
+
+import hashlib
+import os
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class FingerprintServiceTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self._tmp.name).joinpath("file.bin")
+        self.path.write_bytes(b"contents")
+        self.fingerprints = FingerprintService()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_digest_is_memoised(self):
+        expected = hashlib.sha256(b"contents").hexdigest()
+        self.assertEqual(self.fingerprints.digest(self.path, "sha256"), expected)
+        self.assertEqual(self.fingerprints.digest(self.path, "sha256"), expected)
+        self.assertEqual(self.fingerprints.computed, 1)
+        self.assertEqual(self.fingerprints.avoided, 1)
+
+    def test_missing_algorithms_are_computed(self):
+        self.fingerprints.digest(self.path, "sha256")
+        digests = self.fingerprints.digests(self.path, ["sha256", "md5"])
+        self.assertEqual(digests["md5"], hashlib.md5(b"contents").hexdigest())
+        self.assertEqual(self.fingerprints.computed, 2)
+        self.assertEqual(self.fingerprints.avoided, 1)
+
+    def test_changed_file_is_hashed_again(self):
+        self.fingerprints.digest(self.path, "sha256")
+        self.path.write_bytes(b"other contents")
+        st = os.stat(self.path)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+
+        self.assertEqual(
+            self.fingerprints.digest(self.path, "sha256"),
+            hashlib.sha256(b"other contents").hexdigest(),
+        )
+        self.assertEqual(self.fingerprints.computed, 2)
+
+    def test_digests_are_not_pickled(self):
+        self.fingerprints.digest(self.path, "sha256")
+        copy = pickle.loads(pickle.dumps(self.fingerprints))
+        self.assertEqual(copy.computed, 0)
+        copy.digest(self.path, "sha256")
+        self.assertEqual(copy.computed, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
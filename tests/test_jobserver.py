@@ -0,0 +1,118 @@
+from cas.common.jobserver import Jobserver
+
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+
+@unittest.skipIf(os.name != "posix", "the jobserver is only supported on POSIX")
+class JobserverTest(unittest.TestCase):
+    def jobserver(self, jobs: int, makeflags: str = "") -> Jobserver:
+        with mock.patch.dict(os.environ, {"MAKEFLAGS": makeflags}):
+            jobserver = Jobserver(jobs)
+        self.addCleanup(jobserver.dispose)
+        return jobserver
+
+    def acquire(self, jobserver: Jobserver, timeout: float = 5) -> bool:
+        # the way the scheduler waits for a token
+        arrived = threading.Event()
+        if jobserver.try_acquire(arrived.set):
+            return True
+        return arrived.wait(timeout) and jobserver.try_acquire(arrived.set)
+
+    def pipe(self, tokens: int):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        os.write(write_fd, b"+" * tokens)
+        return read_fd, write_fd
+
+    def test_hosted_slots(self):
+        jobserver = self.jobserver(3)
+        self.assertTrue(jobserver.enabled)
+        self.assertTrue(jobserver.serves(3))
+        self.assertFalse(jobserver.serves(4))
+
+        # one slot is implicit
+        self.assertTrue(self.acquire(jobserver))
+        self.assertTrue(self.acquire(jobserver))
+        self.assertFalse(self.acquire(jobserver, 0.2))
+
+        # a released token goes to whoever is waiting for one
+        arrived = threading.Event()
+        self.assertFalse(jobserver.try_acquire(arrived.set))
+        jobserver.release()
+        self.assertTrue(arrived.wait(5))
+        self.assertTrue(jobserver.try_acquire())
+
+    def test_uses_the_jobserver_of_make(self):
+        read_fd, write_fd = self.pipe(1)
+        makeflags = f" -j4 --jobserver-auth={read_fd},{write_fd}"
+        jobserver = self.jobserver(2, makeflags)
+        self.assertTrue(jobserver.serves(8))
+
+        self.assertTrue(self.acquire(jobserver))
+        self.assertFalse(self.acquire(jobserver, 0.2))
+
+        # once nothing waits for a token anymore, a released one goes back to make
+        jobserver.close()
+        jobserver.release()
+        self.assertEqual(os.read(read_fd, 1), b"+")
+
+        # makes started by us inherit the flags as they are
+        with mock.patch.dict(os.environ, {"MAKEFLAGS": makeflags}):
+            self.assertEqual(jobserver.makeflags(), makeflags)
+        self.assertEqual(jobserver.fds(), (read_fd, write_fd))
+
+    def test_uses_the_fifo_of_make(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fifo = os.path.join(tmp, "jobserver")
+            os.mkfifo(fifo)
+            # keep the fifo open, as make would
+            holder = os.open(fifo, os.O_RDWR)
+            self.addCleanup(os.close, holder)
+            os.write(holder, b"+")
+
+            jobserver = self.jobserver(2, f"-j2 --jobserver-auth=fifo:{fifo}")
+            self.assertTrue(self.acquire(jobserver))
+            self.assertEqual(jobserver.fds(), ())
+            jobserver.release()
+            self.assertEqual(os.read(holder, 1), b"+")
+
+    def test_closed_descriptors_fall_back_to_hosting(self):
+        read_fd, write_fd = os.pipe()
+        os.close(read_fd)
+        os.close(write_fd)
+        with self.assertLogs("cas.common.jobserver", "WARNING"):
+            jobserver = self.jobserver(2, f"-j4 --jobserver-auth={read_fd},{write_fd}")
+        self.assertTrue(jobserver.serves(2))
+        self.assertFalse(jobserver.serves(4))
+
+    def test_hosted_makeflags(self):
+        jobserver = self.jobserver(4)
+        with mock.patch.dict(os.environ, {"MAKEFLAGS": "k -j2 --jobserver-auth=8,9"}):
+            flags = jobserver.makeflags()
+        read_fd, write_fd = jobserver.fds()
+        self.assertEqual(
+            flags,
+            f"k -j4 --jobserver-fds={read_fd},{write_fd}"
+            f" --jobserver-auth={read_fd},{write_fd}",
+        )
+
+    def test_unused_tokens_are_given_back(self):
+        read_fd, write_fd = self.pipe(0)
+        jobserver = self.jobserver(2, f"-j2 --jobserver-auth={read_fd},{write_fd}")
+
+        # the token arrives after the build stopped waiting for it
+        arrived = threading.Event()
+        self.assertFalse(jobserver.try_acquire(arrived.set))
+        os.write(write_fd, b"+")
+        self.assertTrue(arrived.wait(5))
+        jobserver.close()
+        self.assertEqual(os.read(read_fd, 1), b"+")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+from cas.common.assets.drivers.model import ModelDriver
+from cas.common.assets.models import Asset
+from cas.common.cache import CacheManager
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+class ModelDriverTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name).resolve()
+        self.models = self.root.joinpath("content", "mymod", "models")
+        self.models.mkdir(parents=True)
+
+        cache = CacheManager(self.root)
+        cache.load()
+        self.addCleanup(cache._backend.close)
+        env = mock.Mock()
+        env.root = self.root
+        env.game = self.root.joinpath("game")
+        env.cache = cache
+        env.fingerprints = cache.fingerprints
+        env.get_tool.return_value = self.root.joinpath("mdlcompile")
+        self.driver = ModelDriver(env)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def write(self, name: str, text: str) -> Path:
+        path = self.models.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+        return path
+
+    def deps(self, path: Path):
+        inputs, outputs = self.driver._parse_deps_from_vdf(path)
+        return (
+            sorted(f.relative_to(self.models).as_posix() for f in inputs),
+            sorted(f.as_posix() for f in outputs),
+        )
+
+    def test_tokens(self):
+        path = self.write(
+            "box.qc",
+            """
+            $ModelName "props/box"
+            $body body "box body.smd"
+            // $include "commented.qci"
+            /* $sequence idle "commented.smd"
+               fps 30 */
+            $sequence idle { "idle.SMD" fps 30 }
+            $includemodel "props/shared_anims.mdl"
+            $cdmaterials "models/props"
+            $pushd "anims" $animation run run.dmx $popd
+            """,
+        )
+        self.assertEqual(
+            self.driver._parse_qc(path),
+            [
+                ("output", "props/box"),
+                ("input", "box body.smd"),
+                ("input", "idle.SMD"),
+                ("pushd", "anims"),
+                ("input", "run.dmx"),
+                ("popd", ""),
+            ],
+        )
+
+    def test_includes_are_followed(self):
+        self.write(
+            "shared/common.qci",
+            '$include "shared/nested.qci"\n$body body "common.smd"\n',
+        )
+        self.write("shared/nested.qci", '$include "box.qc"\n$sequence a "a.dmx"\n')
+        path = self.write(
+            "box.qc",
+            '$modelname props\\box.mdl\n$include "shared/common.qci"\n'
+            '$include "missing.qci"\n$pushd lods\n$lod 1 "lod1.smd"\n$popd\n'
+            '$cd sub\n$body b "b.smd"\n',
+        )
+        inputs, outputs = self.deps(path)
+        # includes are relative to the model's folder, not the including file's
+        self.assertEqual(
+            inputs,
+            [
+                "a.dmx",
+                "box.qc",
+                "common.smd",
+                "lods/lod1.smd",
+                "missing.qci",
+                "shared/common.qci",
+                "shared/nested.qci",
+                "sub/b.smd",
+            ],
+        )
+        self.assertEqual(outputs, ["props/box.mdl"])
+
+    def test_parses_are_cached(self):
+        path = self.write("box.qc", '$modelname box\n$body b "b.smd"\n')
+        parse = ModelDriver._parse_qc
+        with mock.patch.object(
+            ModelDriver, "_parse_qc", autospec=True, side_effect=parse
+        ) as parsed:
+            self.assertEqual(self.deps(path), (["b.smd"], ["box.mdl"]))
+            self.assertEqual(self.deps(path), (["b.smd"], ["box.mdl"]))
+            self.assertEqual(parsed.call_count, 1)
+
+            self.write("box.qc", '$modelname box\n$body b "other.smd"\n')
+            self.assertEqual(self.deps(path), (["other.smd"], ["box.mdl"]))
+            self.assertEqual(parsed.call_count, 2)
+
+    def test_precompile(self):
+        path = self.write("box.qc", '$modelname "props/box"\n$body b "b.smd"\n')
+        result = self.driver.precompile(None, Asset(path, self.root))
+        self.assertEqual(set(result.inputs), {path, self.models.joinpath("b.smd")})
+        models = self.root.joinpath("game", "mymod", "models", "props")
+        self.assertEqual(
+            set(result.outputs),
+            {
+                models.joinpath("box.mdl"),
+                models.joinpath("box.dx90.vtx"),
+                models.joinpath("box.vvd"),
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+import cas.common.utilities as utilities
+from cas.common.scanner import FileScanner
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from typing import List, Mapping
+
+
+def _legacy_rglob_multi(root: Path, patterns: List[str]) -> Mapping[Path, int]:
+    """
+    rglob_multi as it was before it became a single pass, returning the files it
+    found in order along with the pattern that added each of them
+    """
+    files = {}
+    for i, pattern in enumerate(patterns):
+        exclusion = pattern.startswith("!")
+        if exclusion:
+            pattern = pattern[1:]
+
+        for path in root.rglob(pattern):
+            if not path.is_file():
+                continue
+            if exclusion:
+                files.pop(path, None)
+            elif path not in files:
+                files[path] = i
+    return files
+
+
+class _RecordingScanner(FileScanner):
+    def __init__(self):
+        super().__init__()
+        self.paths = []
+
+    def _list(self, path: str):
+        self.paths.append(path)
+        return super()._list(path)
+
+
+class _TreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        for name in [
+            "a.txt",
+            "a.dat",
+            "sub/b.txt",
+            "sub/b.dat",
+            "sub/c.txt",
+            "sub/deep/d.txt",
+            "sub/deep/d.dat",
+            "skip/e.txt",
+            "skip/nested/f.txt",
+            "models/m.qc",
+            "models/m.qci",
+            "other/models/n.qc",
+            "other/models/shared/o.qci",
+        ]:
+            path = self.root.joinpath(name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def relpaths(self, paths: List[Path]) -> List[str]:
+        return sorted(path.relative_to(self.root).as_posix() for path in paths)
+
+
+class RglobMultiTest(_TreeTestCase):
+    def assertMatchesLegacy(self, patterns: List[str]) -> List[Path]:
+        """
+        Checks the files found are the ones the old implementation found, ordered
+        by the pattern that added them. Within a pattern, the old order was that of
+        Path.rglob, which isn't specified.
+        """
+        expected = _legacy_rglob_multi(self.root, patterns)
+        result = utilities.rglob_multi(self.root, patterns)
+
+        self.assertEqual(len(result), len(set(result)))
+        self.assertEqual(set(result), set(expected))
+        added = [expected[path] for path in result]
+        self.assertEqual(added, sorted(added))
+        return result
+
+    def test_ordered_by_adding_pattern(self):
+        result = self.assertMatchesLegacy(["*.dat", "*.txt"])
+        self.assertTrue(all(path.suffix == ".dat" for path in result[:3]))
+        self.assertTrue(all(path.suffix == ".txt" for path in result[3:]))
+
+    def test_duplicate_matches_keep_first_pattern(self):
+        result = self.assertMatchesLegacy(["sub/*.txt", "*.txt"])
+        self.assertEqual(self.relpaths(result[:2]), ["sub/b.txt", "sub/c.txt"])
+
+    def test_reinclude_after_exclude(self):
+        result = self.assertMatchesLegacy(["*.txt", "!sub/*.txt", "b.txt"])
+        self.assertIn("sub/b.txt", self.relpaths(result))
+        self.assertNotIn("sub/c.txt", self.relpaths(result))
+        # re-included files move to the pattern that added them again
+        self.assertEqual(self.relpaths(result[-1:]), ["sub/b.txt"])
+
+    def test_exclude_then_include_other_type(self):
+        self.assertMatchesLegacy(["*.txt", "!*.txt", "*.dat"])
+
+    def test_exclude_everything(self):
+        result = self.assertMatchesLegacy(["*.txt", "!*", "*.dat"])
+        self.assertEqual(
+            self.relpaths(result), ["a.dat", "sub/b.dat", "sub/deep/d.dat"]
+        )
+
+    def test_double_star(self):
+        self.assertMatchesLegacy(["**/*.qc", "models/**/*.qci"])
+        self.assertMatchesLegacy(["**/models/*.qc", "**/*.qci", "!other/**/*"])
+
+    def test_excluded_folder_is_pruned(self):
+        patterns = ["*.txt", "!skip/**/*"]
+        self.assertMatchesLegacy(patterns)
+
+        scanner = _RecordingScanner()
+        scanner.glob_filtered(self.root, patterns)
+        listed = [
+            Path(path).relative_to(self.root).as_posix() for path in scanner.paths
+        ]
+        self.assertIn("sub/deep", listed)
+        self.assertNotIn("skip", listed)
+        self.assertNotIn("skip/nested", listed)
+
+    def test_exclude_everything_prunes_everything(self):
+        scanner = _RecordingScanner()
+        self.assertEqual(scanner.glob_filtered(self.root, ["*.txt", "!*"]), [])
+        self.assertEqual(scanner.paths, [str(self.root)])
+
+    def test_excluded_folder_with_later_include_is_walked(self):
+        patterns = ["*.txt", "!skip/**/*", "f.txt"]
+        result = self.assertMatchesLegacy(patterns)
+        self.assertIn("skip/nested/f.txt", self.relpaths(result))
+
+        scanner = _RecordingScanner()
+        scanner.glob_filtered(self.root, patterns)
+        self.assertIn(str(self.root.joinpath("skip", "nested")), scanner.paths)
+
+    @unittest.skipIf(not hasattr(os, "symlink"), "symlinks are not supported")
+    def test_linked_folders_are_not_followed(self):
+        try:
+            os.symlink(self.root.joinpath("sub"), self.root.joinpath("link"))
+        except OSError:
+            self.skipTest("unable to create symlinks")
+        result = self.assertMatchesLegacy(["*.txt"])
+        self.assertNotIn("link/b.txt", self.relpaths(result))
+
+
+class GlobTest(_TreeTestCase):
+    def test_matches_rglob(self):
+        for pattern in ["*.txt", "sub/*.dat", "**/models/*.qc"]:
+            result = list(FileScanner().glob(self.root, [pattern]))
+            self.assertEqual(set(result), set(self.root.rglob(pattern)))
+
+    def test_yields_while_walking(self):
+        scanner = _RecordingScanner()
+        found = scanner.glob(self.root, ["a.txt"])
+        self.assertEqual(scanner.paths, [])
+        self.assertEqual(next(found), self.root.joinpath("a.txt"))
+        self.assertEqual(scanner.paths, [str(self.root)])
+
+
+class DirectoryIndexTest(_TreeTestCase):
+    def age(self):
+        # listings are only remembered once their directory's timestamp has settled
+        past = time.time() - 60
+        for path in [self.root, *self.root.rglob("*")]:
+            if path.is_dir():
+                os.utime(path, (past, past))
+
+    def glob(self, index: dict) -> FileScanner:
+        scanner = FileScanner(index)
+        self.found = self.relpaths(scanner.glob(self.root, ["*.txt"]))
+        return scanner
+
+    def test_unchanged_directories_are_not_listed_again(self):
+        self.age()
+        index = {}
+        scanner = self.glob(index)
+        self.assertEqual(scanner.listed, 9)
+        self.assertEqual(len(index), 9)
+        expected = self.found
+
+        scanner = self.glob(index)
+        self.assertEqual(scanner.listed, 0)
+        self.assertEqual(scanner.indexed, 9)
+        self.assertEqual(self.found, expected)
+
+    def test_changed_directory_is_listed_again(self):
+        self.age()
+        index = {}
+        self.glob(index)
+
+        self.root.joinpath("sub", "new.txt").write_text("new")
+        scanner = self.glob(index)
+        self.assertEqual(scanner.listed, 1)
+        self.assertIn("sub/new.txt", self.found)
+
+    def test_recent_listings_are_not_remembered(self):
+        index = {}
+        scanner = self.glob(index)
+        self.assertEqual(scanner.listed, 9)
+        self.assertEqual(index, {})
+
+    def test_removed_directories_are_collected(self):
+        self.age()
+        index = {}
+        self.glob(index)
+
+        shutil.rmtree(self.root.joinpath("skip"))
+        self.age()
+        scanner = self.glob(index)
+        scanner.garbage_collect()
+        self.assertNotIn(str(self.root.joinpath("skip")), index)
+        self.assertNotIn(str(self.root.joinpath("skip", "nested")), index)
+        self.assertEqual(len(index), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
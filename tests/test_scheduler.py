@@ -0,0 +1,237 @@
+import cas.common.assets.scheduler as scheduler
+import cas.common.utilities as utilities
+from cas.common.assets.models import Asset, BatchedDriver, SerialDriver
+from cas.common.assets.scheduler import SERIAL, THREAD, AssetJob, AssetScheduler
+
+import logging
+import pickle
+import queue
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+class _RecordingPool:
+    """
+    Stands in for a lane's pool, recording the jobs started on it
+    """
+
+    def __init__(self, started):
+        self._started = started
+
+    def apply_async(self, fn, args, callback=None, error_callback=None):
+        index, key, paths = args[0]
+        self._started.append(key)
+
+
+class AssetSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        # only the budget limits memory, not what happens to be free right now
+        patcher = mock.patch.object(
+            utilities, "get_available_memory", return_value=None
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.started = []
+
+    def scheduler(self, threads: int, memory_budget: int = None) -> AssetScheduler:
+        result = AssetScheduler(
+            [], threads, False, 4, Path("."), logging.getLogger(__name__), memory_budget
+        )
+        result._lane_pool = lambda lane: _RecordingPool(self.started)
+        return result
+
+    def job(
+        self,
+        key: str,
+        estimate: float,
+        index: int = 0,
+        lane: str = THREAD,
+        **kwargs,
+    ) -> AssetJob:
+        job = AssetJob(index, key, [], lane)
+        job.estimate = estimate
+        for k, v in kwargs.items():
+            setattr(job, k, v)
+        return job
+
+    def submit(self, sched: AssetScheduler, *jobs: AssetJob):
+        for job in jobs:
+            self.assertTrue(sched._admit(job))
+
+    def finish(self, sched: AssetScheduler, key: str):
+        # what run does with the result of a job
+        sched._resources.release(sched._running.pop(key))
+        sched._resolve(key, True)
+
+    def test_longest_jobs_start_first(self):
+        sched = self.scheduler(2)
+        self.submit(
+            sched,
+            self.job("a", 1.0),
+            self.job("b", 5.0),
+            self.job("c", 3.0),
+            self.job("d", 4.0, index=1),
+        )
+        sched._dispatch()
+        self.assertEqual(self.started, ["b", "d"])
+
+        self.finish(sched, "d")
+        sched._dispatch()
+        self.assertEqual(self.started, ["b", "d", "c"])
+
+        self.finish(sched, "b")
+        self.finish(sched, "c")
+        sched._dispatch()
+        self.assertEqual(self.started, ["b", "d", "c", "a"])
+
+    def test_equal_estimates_start_in_submission_order(self):
+        sched = self.scheduler(4)
+        self.submit(sched, *(self.job(key, 1.0) for key in "abcd"))
+        sched._dispatch()
+        self.assertEqual(self.started, ["a", "b", "c", "d"])
+
+    def test_memory_budget(self):
+        sched = self.scheduler(4, memory_budget=100)
+        self.submit(
+            sched,
+            self.job("a", 3.0, memory=60),
+            self.job("b", 2.0, memory=60),
+            self.job("c", 1.0, index=1, memory=30),
+        )
+        # the second largest job would go over the budget, a smaller one still fits
+        sched._dispatch()
+        self.assertEqual(self.started, ["a", "c"])
+
+        self.finish(sched, "a")
+        sched._dispatch()
+        self.assertEqual(self.started, ["a", "c", "b"])
+
+    def test_job_over_the_whole_budget_runs_alone(self):
+        sched = self.scheduler(4, memory_budget=100)
+        self.submit(sched, self.job("a", 2.0, memory=500), self.job("b", 1.0))
+        sched._dispatch()
+        self.assertEqual(self.started, ["a", "b"])
+
+        sched = self.scheduler(4, memory_budget=100)
+        self.started.clear()
+        self.submit(
+            sched, self.job("a", 2.0, memory=50), self.job("b", 1.0, memory=500)
+        )
+        sched._dispatch()
+        self.assertEqual(self.started, ["a"])
+
+    def test_driver_concurrency_limit(self):
+        sched = self.scheduler(4)
+        self.submit(
+            sched,
+            self.job("a", 3.0, driver="model", max_concurrency=1),
+            self.job("b", 2.0, driver="model", max_concurrency=1),
+            self.job("c", 1.0, index=1, driver="caption"),
+        )
+        sched._dispatch()
+        self.assertEqual(self.started, ["a", "c"])
+
+        self.finish(sched, "a")
+        sched._dispatch()
+        self.assertEqual(self.started, ["a", "c", "b"])
+
+    def test_serial_lane_runs_one_job_alongside_the_pools(self):
+        sched = self.scheduler(3)
+        self.submit(
+            sched,
+            self.job("a", 5.0),
+            self.job("b", 1.0, index=1, lane=SERIAL),
+            self.job("c", 2.0, index=1, lane=SERIAL),
+            self.job("d", 4.0),
+        )
+        # the serial lane starts first, even though its jobs are shorter
+        sched._dispatch()
+        self.assertEqual(self.started, ["c", "a", "d"])
+
+        self.finish(sched, "a")
+        sched._dispatch()
+        self.assertEqual(self.started, ["c", "a", "d"])
+
+        self.finish(sched, "c")
+        sched._dispatch()
+        self.assertEqual(self.started, ["c", "a", "d", "b"])
+
+    def test_dependents_wait_for_their_dependencies(self):
+        sched = self.scheduler(4)
+        self.submit(
+            sched,
+            self.job("a", 1.0),
+            self.job("b", 5.0, index=1, depends={"a"}),
+        )
+        sched._dispatch()
+        self.assertEqual(self.started, ["a"])
+
+        self.finish(sched, "a")
+        sched._dispatch()
+        self.assertEqual(self.started, ["a", "b"])
+
+    def test_predicted_makespan(self):
+        sched = self.scheduler(2)
+        jobs = [self.job("a", 1.0), self.job("b", 4.0), self.job("c", 3.0)]
+        # longest first puts the two short jobs on one thread
+        self.assertEqual(sched.predict_makespan(jobs), 4.0)
+
+
+class AsyncJobTest(unittest.TestCase):
+    def setUp(self):
+        self.root = Path("/project")
+        self.assets = [
+            Asset(self.root.joinpath("content", f"{i}.qc"), self.root) for i in range(2)
+        ]
+        self.events = queue.SimpleQueue()
+
+    def run_job(self, driver):
+        driver.env = mock.Mock(root=self.root)
+        context = mock.Mock(driver=driver)
+        scheduler._async_mod_init(threading.Lock(), self.events, [context])
+        self.addCleanup(scheduler._async_mod_init, None, None, None)
+
+        job = AssetJob(0, "job", self.assets, THREAD)
+        # workers only get the descriptor, not the assets or their context
+        descriptor = pickle.loads(pickle.dumps(job.descriptor()))
+        self.assertEqual(
+            descriptor, (0, "job", [str(asset.path) for asset in self.assets])
+        )
+        key, success, _ = scheduler._run_async_job(descriptor)
+        self.assertEqual(key, "job")
+        self.assertEqual(self.events.get_nowait()[0], "job")
+        return context, success
+
+    def test_serial_driver(self):
+        driver = mock.Mock(spec=SerialDriver)
+        driver.compile.return_value = True
+        context, success = self.run_job(driver)
+        self.assertTrue(success)
+
+        (compiled_context, asset), _ = driver.compile.call_args
+        self.assertIs(compiled_context, context)
+        self.assertEqual(
+            (asset.path, asset.id), (self.assets[0].path, self.assets[0].id)
+        )
+
+    def test_batched_driver(self):
+        driver = mock.Mock(spec=BatchedDriver)
+        driver.compile_all.return_value = True
+        _, success = self.run_job(driver)
+        self.assertTrue(success)
+
+        (_, assets), _ = driver.compile_all.call_args
+        self.assertEqual([a.id for a in assets], [a.id for a in self.assets])
+
+    def test_driver_exception_is_a_failure(self):
+        driver = mock.Mock(spec=SerialDriver)
+        driver.compile.side_effect = RuntimeError("broken")
+        with self.assertLogs("multiprocessing", "ERROR"):
+            _, success = self.run_job(driver)
+        self.assertFalse(success)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import cas.common.utilities as utilities
+import cas.common.watcher as watcher
+from cas.common.watcher import FileWatcher, InotifyWatcher, PollingWatcher
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+class _ScriptedWatcher(FileWatcher):
+    def __init__(self, polls):
+        super().__init__()
+        self.polls = list(polls)
+        self.added = []
+
+    def _add(self, folder, recursive):
+        self.added.append((folder, recursive))
+
+    def _poll(self, timeout):
+        return self.polls.pop(0)
+
+
+class FileWatcherTest(unittest.TestCase):
+    def test_changes_are_handed_out_once_quiet(self):
+        changes = _ScriptedWatcher([{Path("a")}, {Path("b")}, set()])
+        self.assertEqual(changes.wait(), {Path("a"), Path("b")})
+
+    def test_lost_changes(self):
+        changes = _ScriptedWatcher([{Path("a")}, None, {Path("b")}, set()])
+        with self.assertLogs("cas.common.watcher", "WARNING"):
+            self.assertIsNone(changes.wait())
+        self.assertEqual(changes.polls, [])
+
+    def test_folders_are_only_watched_once(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp).resolve()
+            changes = _ScriptedWatcher([])
+            changes.add(root, False)
+            changes.add(root.joinpath("sub"), True)
+            # a recursive watch covers the folder and everything below it
+            changes.add(root, True)
+            changes.add(root.joinpath("sub"), True)
+            changes.add(root, False)
+            self.assertEqual(
+                changes.added,
+                [(root, False), (root.joinpath("sub"), True), (root, True)],
+            )
+
+
+class _WatcherTestCase:
+    """
+    Tests shared by the watcher implementations
+    """
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name).resolve()
+        self.root.joinpath("sub").mkdir()
+        self.file = self.root.joinpath("sub", "a.txt")
+        self.file.write_text("a")
+
+        for name, value in (("_settle_seconds", 0.1), ("_poll_seconds", 0.1)):
+            patcher = mock.patch.object(watcher, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.watcher = self.create()
+        self.addCleanup(self.watcher.close)
+        self.watcher.add(self.root, True)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_modified_and_removed_files(self):
+        self.file.write_text("changed")
+        removed = self.root.joinpath("b.txt")
+        removed.write_text("b")
+        self.assertEqual(self.watcher.wait(), {self.file, removed})
+
+        os.remove(removed)
+        self.assertEqual(self.watcher.wait(), {removed})
+
+    def test_files_in_new_folders(self):
+        new = self.root.joinpath("sub", "new", "deeper", "c.txt")
+        new.parent.mkdir(parents=True)
+        new.write_text("c")
+        self.assertEqual(self.watcher.wait(), {new})
+
+    def test_files_below_a_flat_folder_are_ignored(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = Path(tmp).resolve()
+            folder.joinpath("nested").mkdir()
+            self.watcher.add(folder, False)
+
+            folder.joinpath("nested", "d.txt").write_text("d")
+            self.file.write_text("changed")
+            self.assertEqual(self.watcher.wait(), {self.file})
+
+
+@unittest.skipUnless(utilities.is_platform_linux(), "inotify is only on Linux")
+class InotifyWatcherTest(_WatcherTestCase, unittest.TestCase):
+    def create(self) -> FileWatcher:
+        return InotifyWatcher()
+
+
+class PollingWatcherTest(_WatcherTestCase, unittest.TestCase):
+    def create(self) -> FileWatcher:
+        return PollingWatcher()
+
+
+if __name__ == "__main__":
+    unittest.main()